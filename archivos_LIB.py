@@ -1,6 +1,58 @@
+import os
+import csv
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from collections import deque
+from logging.handlers import QueueListener, RotatingFileHandler
 from pathlib import Path
-import pandas as pd
-from datetime import datetime
+from types import MappingProxyType
+from logs_LIB import obtener_logger
+
+log = obtener_logger("archivos")
+
+COLUMNAS_CONFIGURACION = ["clave", "valor"]
+
+class RegistroErrores:
+    """
+    Registro de errores y eventos en un archivo propio con rotación por tamaño.
+    registrar() solo encola; un hilo en segundo plano escribe en disco, así una
+    ráfaga de errores nunca bloquea el lazo de radio. Si la cola se llena los
+    mensajes se descartan y se cuentan en 'descartados'.
+    """
+    def __init__(self, file_name="errores.log", directory=None, max_bytes=1_000_000, respaldos=5, capacidad_cola=10000):
+        user_home = Path.home()
+        self.directory = Path(directory or user_home / "Desktop" / "llamado_enfermeria")
+        self.file_path = self.directory / file_name
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self.cola = queue.Queue(maxsize=capacidad_cola)
+        self.descartados = 0
+
+        self._handler = RotatingFileHandler(self.file_path, maxBytes=max_bytes, backupCount=respaldos, encoding="utf-8")
+        self._handler.setFormatter(logging.Formatter("%(asctime)s,%(levelname)s,%(message)s", "%d-%m-%Y_%H-%M-%S"))
+        self._listener = QueueListener(self.cola, self._handler)
+        self._listener.start()
+
+    def registrar(self, mensaje, nivel=logging.ERROR):
+        registro = logging.LogRecord("llamado_enfermeria", nivel, __file__, 0, str(mensaje).strip(), None, None)
+        try:
+            self.cola.put_nowait(registro)
+        except queue.Full:
+            self.descartados += 1
+
+    def cerrar(self):
+        """
+        Vacía la cola pendiente en disco y detiene el hilo escritor.
+        """
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+            self._handler.close()
+
 
 class FileHandler:
     def __init__(self, file_name="configuracion.csv", directory=None):
@@ -9,13 +61,23 @@ class FileHandler:
         self.directory = Path(directory or user_home / "Desktop" / "llamado_enfermeria")
         self.file_path = self.directory / file_name
 
+        # Copia en memoria (inmutable) de la configuración y mtime del archivo al leerla
+        self.configuracion = MappingProxyType({})
+        self._mtime = None
+        self._suscriptores = []
+        self._notificando = False
+        self.recargas = 0  # cambios de configuración aplicados después de la primera lectura
+
+        # Registro de errores separado del archivo de configuración (se crea al primer uso)
+        self.registro = None
+
         try:
             self.directory.mkdir(parents=True, exist_ok=True)
         except PermissionError:
-            print(f"[FileHandler] Error: No se tienen permisos para crear el directorio {self.directory}.")
+            log.error("No se tienen permisos para crear el directorio %s", self.directory)
             raise
         except Exception as e:
-            print(f"[FileHandler] Error al crear el directorio: {e}")
+            log.error("Error al crear el directorio: %s", e)
             raise
 
     def crear_archivo(self):
@@ -25,11 +87,10 @@ class FileHandler:
                 {"clave": "sede", "valor": ""},
                 {"clave": "area", "valor": ""}
             ]
-            df = pd.DataFrame(data_inicial)
-            df.to_csv(self.file_path, index=False)
-            print(f"[FileHandler] Archivo creado con claves iniciales en {self.file_path}")
+            self._escribir(data_inicial)
+            log.info("Archivo creado con claves iniciales en %s", self.file_path)
         else:
-            print(f"[FileHandler] El archivo ya existe: {self.file_path}")
+            log.debug("El archivo ya existe: %s", self.file_path)
 
 
     def actualizar_archivo(self, data: dict):
@@ -41,36 +102,252 @@ class FileHandler:
         """
         # Asegurarnos de que el archivo exista
         if not self.file_path.exists():
-            print(f"[FileHandler] El archivo no existe, creando uno nuevo...")
+            log.info("El archivo no existe, creando uno nuevo...")
             self.crear_archivo()
 
-        df = pd.read_csv(self.file_path)
+        filas = self._leer()
 
         # Para cada clave/valor en data
         for clave, valor in data.items():
-            if clave in df["clave"].values:
-                df.loc[df["clave"] == clave, "valor"] = valor
+            valor = "" if valor is None else str(valor)
+            coincidencias = [fila for fila in filas if fila["clave"] == clave]
+            if coincidencias:
+                for fila in coincidencias:
+                    fila["valor"] = valor
             else:
-                df = pd.concat([df, pd.DataFrame([{"clave": clave, "valor": valor}])], ignore_index=True)
+                filas.append({"clave": str(clave), "valor": valor})
 
         # Guardar cambios
-        df.to_csv(self.file_path, index=False)
-        print(f"[FileHandler] Archivo actualizado en {self.file_path}")
+        self._escribir(filas)
+        log.info("Archivo actualizado en %s", self.file_path)
+        self._refrescar(filas)
 
-    def leer_archivo(self) -> pd.DataFrame:
+    def leer_archivo(self) -> list:
         """
-        Lee y devuelve todo el contenido del CSV como DataFrame.
+        Lee y devuelve todo el contenido del CSV como lista de filas {"clave": ..., "valor": ...}.
         Si no existe, lo crea primero.
         """
         if not self.file_path.exists():
-            print(f"[FileHandler] El archivo no existe, creando uno nuevo...")
+            log.info("El archivo no existe, creando uno nuevo...")
             self.crear_archivo()
-        return pd.read_csv(self.file_path)
+        filas = self._leer()
+        self._refrescar(filas)
+        return filas
+
+    def _leer(self) -> list:
+        with open(self.file_path, newline="", encoding="utf-8") as f:
+            return [
+                {"clave": fila.get("clave") or "", "valor": fila.get("valor") or ""}
+                for fila in csv.DictReader(f)
+            ]
+
+    def _escribir(self, filas):
+        """
+        Escribe el CSV en un archivo temporal y lo reemplaza de forma atómica:
+        un corte de energía deja el archivo anterior o el nuevo, nunca uno a medias.
+        """
+        temporal = self.file_path.with_name(self.file_path.name + ".tmp")
+        with open(temporal, "w", newline="", encoding="utf-8") as f:
+            escritor = csv.DictWriter(f, fieldnames=COLUMNAS_CONFIGURACION, lineterminator="\n")
+            escritor.writeheader()
+            escritor.writerows(filas)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.file_path)
+
+    def obtener_configuracion(self) -> MappingProxyType:
+        """
+        Devuelve la copia en memoria de la configuración {clave: valor}.
+        Solo lee el archivo la primera vez; después usar verificar_cambios().
+        """
+        if self._mtime is None:
+            self.leer_archivo()
+        return self.configuracion
+
+    def verificar_cambios(self) -> bool:
+        """
+        Recarga la configuración si el mtime del archivo cambió (edición externa).
+        Retorna True si hubo recarga.
+        """
+        try:
+            mtime = self.file_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and mtime == self._mtime:
+            return False
+        self.leer_archivo()
+        return True
+
+    def suscribir(self, callback):
+        """
+        Registra callback(configuracion) que se llama cada vez que la configuración cambia.
+        Si ya hay configuración cargada se llama de inmediato.
+        """
+        self._suscriptores.append(callback)
+        if self._mtime is not None:
+            callback(self.configuracion)
+
+    def _refrescar(self, filas):
+        primera = self._mtime is None
+        self._mtime = self.file_path.stat().st_mtime_ns
+        nueva = {fila["clave"]: fila["valor"] for fila in filas}
+        if nueva == dict(self.configuracion):
+            return
+        self.configuracion = MappingProxyType(nueva)
+        if not primera:
+            self.recargas += 1
+
+        # Un suscriptor puede volver a escribir el archivo; no se notifica en cadena
+        if self._notificando:
+            return
+        self._notificando = True
+        try:
+            for callback in self._suscriptores:
+                try:
+                    callback(self.configuracion)
+                except Exception as e:
+                    log.error("Error notificando cambio de configuración: %s", e)
+        finally:
+            self._notificando = False
     
     def log_errores(self, valor):
         """
-        Guarda un error en el archivo de configuración usando timestamp como clave.
+        Guarda un error en el registro de errores (errores.log) sin bloquear.
+        """
+        self.log_eventos(valor, nivel=logging.ERROR)
+
+    def log_eventos(self, valor, nivel=logging.INFO):
+        if self.registro is None:
+            self.registro = RegistroErrores(directory=self.directory)
+        self.registro.registrar(valor, nivel)
+
+    def cerrar(self):
+        if self.registro:
+            self.registro.cerrar()
+            self.registro = None
+
+
+class BandejaSalida:
+    """
+    Bandeja de salida persistente (SQLite en modo WAL) para los eventos a publicar.
+    Cada payload se guarda con su tópico antes de publicarse y se borra al confirmarse,
+    así ningún llamado se pierde mientras no hay internet o MQTT está caído.
+    Las lecturas son por lotes, por lo que la memoria no crece con el tamaño del atraso.
+    Los eventos salen por prioridad (0 = más urgente) y luego por orden de llegada.
+    """
+    def __init__(self, file_name="bandeja_salida.db", directory=None, ventana_tasa=60.0):
+        user_home = Path.home()
+        self.directory = Path(directory or user_home / "Desktop" / "llamado_enfermeria")
+        self.file_path = self.directory / file_name
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(self.file_path, check_same_thread=False, isolation_level=None)
+        self._conexion.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS salida ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, payload TEXT NOT NULL, creado REAL NOT NULL)"
+        )
+        columnas = [fila[1] for fila in self._conexion.execute("PRAGMA table_info(salida)")]
+        if "prioridad" not in columnas:
+            self._conexion.execute("ALTER TABLE salida ADD COLUMN prioridad INTEGER NOT NULL DEFAULT 1")
+        self._conexion.execute("CREATE INDEX IF NOT EXISTS salida_prioridad ON salida (prioridad, id)")
+
+        # Estadísticas
+        self.total_encolados = 0
+        self.total_reenviados = 0
+        self.compactaciones = 0
+        self._sin_compactar = 0          # confirmados desde la última compactación
+        self.ventana_tasa = ventana_tasa
+        self._confirmaciones = deque()   # time.monotonic() de cada confirmación dentro de la ventana
+        self._pendientes = self._conexion.execute("SELECT COUNT(*) FROM salida").fetchone()[0]
+
+    def agregar(self, topic: str, payload, prioridad: int = 1) -> int:
+        """
+        Guarda un evento al final de su clase de prioridad. Retorna su id.
         """
-        timestamp = datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
-        data = {timestamp: valor}
-        self.actualizar_archivo(data)
+        # Los payload ya serializados (str o bytes) se guardan tal cual y se publican sin tocar
+        texto = payload if isinstance(payload, (str, bytes)) else json.dumps(payload)
+        with self._lock:
+            cursor = self._conexion.execute(
+                "INSERT INTO salida (topic, payload, creado, prioridad) VALUES (?, ?, ?, ?)",
+                (topic, texto, time.time(), prioridad)
+            )
+            self._pendientes += 1
+            self.total_encolados += 1
+            return cursor.lastrowid
+
+    def pendientes(self, limite: int = 10, excluir=()):
+        """
+        Devuelve hasta 'limite' eventos [(id, topic, payload)] por prioridad y orden de llegada,
+        salteando los ids de 'excluir' (p. ej. los que ya están en vuelo). El payload sale
+        tal como se guardó (bytes o str JSON), listo para publicar sin volver a serializar.
+        """
+        excluir = list(excluir)
+        marcas = ",".join("?" * len(excluir))
+        with self._lock:
+            filas = self._conexion.execute(
+                f"SELECT id, topic, payload FROM salida WHERE id NOT IN ({marcas}) ORDER BY prioridad, id LIMIT ?",
+                (*excluir, limite)
+            ).fetchall()
+        return filas
+
+    def confirmar(self, id_evento: int):
+        """
+        Borra un evento ya publicado. No compacta: se llama desde el hilo de red de paho
+        y un fsync acá frenaría agregar() en el lazo principal (ver compactar()).
+        """
+        with self._lock:
+            borrados = self._conexion.execute("DELETE FROM salida WHERE id = ?", (id_evento,)).rowcount
+            if not borrados:
+                return
+            self._pendientes -= 1
+            self.total_reenviados += 1
+            self._confirmaciones.append(time.monotonic())
+            self._sin_compactar += 1
+
+    def compactar(self, minimo: int = 100) -> bool:
+        """
+        Devuelve al sistema las páginas de los eventos confirmados y trunca el WAL, si desde
+        la última vez se confirmaron al menos 'minimo' eventos. El lazo principal la llama
+        cada tanto. Retorna True si compactó.
+        """
+        with self._lock:
+            if self._conexion is None or self._sin_compactar < minimo:
+                return False
+            # executescript corre cada PRAGMA hasta el final; con execute() incremental_vacuum libera una sola página
+            self._conexion.executescript("PRAGMA incremental_vacuum; PRAGMA wal_checkpoint(TRUNCATE);")
+            self._sin_compactar = 0
+            self.compactaciones += 1
+            return True
+
+    def profundidad(self) -> int:
+        return self._pendientes
+
+    def tasa_reenvio(self) -> float:
+        """
+        Eventos confirmados por segundo en la última ventana.
+        """
+        with self._lock:
+            limite = time.monotonic() - self.ventana_tasa
+            while self._confirmaciones and self._confirmaciones[0] < limite:
+                self._confirmaciones.popleft()
+            return len(self._confirmaciones) / self.ventana_tasa
+
+    def estadisticas(self):
+        return {
+            "pendientes": self.profundidad(),
+            "total_encolados": self.total_encolados,
+            "total_reenviados": self.total_reenviados,
+            "compactaciones": self.compactaciones,
+            "tasa_reenvio": self.tasa_reenvio()
+        }
+
+    def cerrar(self):
+        self.compactar(minimo=1)
+        with self._lock:
+            if self._conexion:
+                self._conexion.close()
+                self._conexion = None
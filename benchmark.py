@@ -0,0 +1,376 @@
+import os
+import sys
+import math
+import json
+import time
+import random
+import argparse
+import subprocess
+import tracemalloc
+import platform
+import tempfile
+import contextlib
+from datetime import datetime
+from tramas_LIB import alfa, CANTIDAD_CARACTERES, decodificar, cifrar
+
+MAC_GATEWAY = "AA:BB:CC:DD:EE:FF"
+
+
+def decode_original(decodifier, key, msg):
+    """
+    Implementación anterior de TramaHandler.decode (búsqueda lineal y concatenación),
+    conservada solo como referencia para comparar.
+    """
+    msg_2 = ""
+    for char in msg:
+        if char in alfa:
+            position = alfa.index(char)
+            if decodifier == 1:
+                position = (position + key) % CANTIDAD_CARACTERES
+            else:
+                position = (position - key) % CANTIDAD_CARACTERES
+            msg_2 += alfa[position]
+        else:
+            msg_2 += char
+    return msg_2
+
+
+def generar_mac(rnd):
+    return ":".join(f"{rnd.randint(0, 255):02X}" for _ in range(6))
+
+
+def generar_tramas(cantidad=10000, semilla=1234, prob_sincro=0.2, mac_gateway=None):
+    """
+    Genera tramas codificadas (direccion, clave, mensaje) como las que envían los botones.
+    """
+    rnd = random.Random(semilla)
+    codigos = ['AA', 'BB', 'BA', 'CC', 'DD', 'EE', 'NN', 'RI', 'SS', 'SI', 'SV']
+    mac_gateway = mac_gateway or generar_mac(rnd)
+    tramas = []
+    for _ in range(cantidad):
+        direccion = rnd.randint(0, 1)
+        clave = rnd.randint(1, 10)
+        if rnd.random() >= prob_sincro:
+            texto = f"{rnd.choice(codigos)},{mac_gateway},{generar_mac(rnd)},0,{rnd.randint(10, 100)}.0"
+        else:
+            texto = f"FF,{generar_mac(rnd)}"
+        # cifrar() con la misma dirección es la operación inversa de decodificar()
+        tramas.append((direccion, clave, cifrar(direccion, clave, texto)))
+    return tramas
+
+
+@contextlib.contextmanager
+def silenciar():
+    """
+    Redirige la salida estándar (también la de subprocesos) a /dev/null mientras se mide.
+    """
+    sys.stdout.flush()
+    copia = os.dup(1)
+    nulo = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(nulo, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(copia, 1)
+        os.close(copia)
+        os.close(nulo)
+
+
+def medir(funcion, argumentos, repeticiones=7, tiempo_minimo=0.2):
+    """
+    Ejecuta funcion(*args) para cada elemento de 'argumentos' y retorna operaciones
+    por segundo (mejor de 'repeticiones'). Cada repetición recorre 'argumentos' las
+    vueltas necesarias para durar al menos 'tiempo_minimo' s: con pasadas de pocos
+    milisegundos el ruido de la máquina supera el umbral de regresión.
+    """
+    # La primera pasada calienta cachés y calibra las vueltas por repetición
+    inicio = time.perf_counter()
+    for args in argumentos:
+        funcion(*args)
+    vueltas = max(1, math.ceil(tiempo_minimo / max(time.perf_counter() - inicio, 1e-6)))
+
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for _ in range(vueltas):
+            for args in argumentos:
+                funcion(*args)
+        mejor = min(mejor, (time.perf_counter() - inicio) / vueltas)
+    return len(argumentos) / mejor
+
+
+# --- Casos ---
+
+def caso_decode_original(contexto):
+    return medir(decode_original, contexto["tramas"][:2000])
+
+
+def caso_decode(contexto):
+    return medir(decodificar, contexto["tramas"])
+
+
+def caso_codificar(contexto):
+    rnd = random.Random(4)
+    macs = [(generar_mac(rnd),) for _ in range(10000)]
+    return medir(contexto["trama"].codificar, macs)
+
+
+def caso_procesar_5(contexto):
+    tramas = [(f"{d},{k},{m}",) for d, k, m in contexto["tramas_5"]]
+    return medir(contexto["trama"].procesar, tramas)
+
+
+def caso_procesar_2(contexto):
+    tramas = [(f"{d},{k},{m}",) for d, k, m in contexto["tramas_2"]]
+    return medir(contexto["trama"].procesar, tramas)
+
+
+def caso_build_json(contexto):
+    rnd = random.Random(7)
+    argumentos = [("Rojo", generar_mac(rnd), float(rnd.randint(10, 100))) for _ in range(10000)]
+    return medir(contexto["trama"].build_json, argumentos)
+
+
+def caso_json_publish(contexto):
+    # Serialización que hace MQTTClientHandler.publicar_async antes de entregar al cliente
+    payload = contexto["trama"].build_json("Rojo", MAC_GATEWAY, 87.0)
+    return medir(json.dumps, [(payload,)] * 10000)
+
+
+def memoria_por_operacion(funcion, argumentos, muestras=200):
+    """
+    Pico de memoria (bytes) que reserva en promedio una llamada, medido con tracemalloc.
+    """
+    total = 0
+    tracemalloc.start()
+    try:
+        for args in argumentos[:muestras]:
+            tracemalloc.reset_peak()
+            inicial = tracemalloc.get_traced_memory()[0]
+            funcion(*args)
+            total += tracemalloc.get_traced_memory()[1] - inicial
+    finally:
+        tracemalloc.stop()
+    return round(total / min(muestras, len(argumentos)))
+
+
+def caso_payload_json(contexto):
+    # Camino anterior: diccionario anidado por evento y json.dumps a bytes
+    trama = contexto["trama"]
+    serializar = lambda llamado, mac, bateria: json.dumps(trama.build_json(llamado, mac, bateria)).encode()
+    argumentos = contexto["eventos"]
+    return medir(serializar, argumentos), {"bytes_op": memoria_por_operacion(serializar, argumentos)}
+
+
+def caso_payload_plantilla(contexto):
+    # Partes fijas pre-renderizadas; solo se escapan los campos variables
+    codificar = contexto["trama"].codificador.codificar
+    argumentos = contexto["eventos"]
+    return medir(codificar, argumentos), {"bytes_op": memoria_por_operacion(codificar, argumentos)}
+
+
+def caso_leer_archivo(contexto):
+    return medir(contexto["archivo"].leer_archivo, [()] * 200)
+
+
+def caso_actualizar_archivo(contexto):
+    datos = [({"area": f"Piso_{i % 5}"},) for i in range(200)]
+    return medir(contexto["archivo"].actualizar_archivo, datos, repeticiones=3)
+
+
+def caso_arranque(contexto, repeticiones=5):
+    """
+    Arranques por segundo de un proceso nuevo que importa todos los módulos del gateway
+    (main.py sin ejecutar el lazo). Informa también el RSS máximo del proceso hijo.
+    """
+    # El hijo informa su propio pico de RSS: VmHWM se reinicia con exec, mientras que
+    # ru_maxrss (RUSAGE_CHILDREN o wait4) arrastra el del benchmark desde el fork
+    comando = [sys.executable, "-c", (
+        "import main\n"
+        "print(next(l.split()[1] for l in open('/proc/self/status') if l.startswith('VmHWM:')))"
+    )]
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    mejor = float("inf")
+    rss_kb = 0
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        salida = subprocess.run(comando, cwd=directorio, check=True, stdout=subprocess.PIPE, text=True).stdout
+        mejor = min(mejor, time.perf_counter() - inicio)
+        rss_kb = max(rss_kb, int(salida.split()[-1]))
+    return 1 / mejor, {"rss_max_mb": round(rss_kb / 1024, 1)}
+
+
+def caso_extremo_a_extremo(contexto, cantidad=3000):
+    """
+    Tramas por segundo a través del camino real de main.py (procesar, ACK, bandeja de
+    salida y publicación) con radio simulada y broker en proceso, hasta confirmar todo.
+    """
+    import main as gateway
+    from lora_LIB import LoRaHandler
+    from mqtt_LIB import MQTTClientHandler
+    from red_LIB import MonitorConectividad
+    from archivos_LIB import BandejaSalida
+    from despacho_LIB import ColaDespacho
+    from simulacion_LIB import RadioSimulada, ClienteMQTTSimulado
+
+    radio = RadioSimulada(MAC_GATEWAY, tasa=1e9, total=cantidad, semilla=3)
+    gateway.archivo = contexto["archivo"]
+    gateway.trama = contexto["trama"]
+    gateway.mac_local = MAC_GATEWAY
+    gateway.topic_base = "bench/piso"
+    gateway.lora = LoRaHandler(radio=radio, capacidad_buffer=cantidad, ciclo_trabajo=None)
+    gateway.cola_despacho = ColaDespacho(capacidad=cantidad)  # la ráfaga entera entra en la cola
+    gateway.bandeja = BandejaSalida(file_name="bench_salida.db", directory=contexto["directorio"])
+    gateway.monitor = MonitorConectividad(verificador=lambda: True)
+    gateway.monitor.notificar_mqtt(True)
+    gateway.mqtt = MQTTClientHandler(cliente=ClienteMQTTSimulado())
+    gateway.mqtt.connect()
+
+    # Generar todas las tramas antes de medir, como una ráfaga que llega al buffer
+    gateway.lora.iniciar_lora()
+    while radio.total_generadas < cantidad:
+        time.sleep(0.01)
+
+    inicio = time.perf_counter()
+    gateway.despachar_tramas()
+    while gateway.bandeja.profundidad():
+        gateway.reenviar_bandeja()
+    duracion = time.perf_counter() - inicio
+
+    gateway.lora.cerrar()
+    gateway.mqtt.disconnect()
+    gateway.bandeja.cerrar()
+    return cantidad / duracion
+
+
+CASOS = {
+    "decode_original": caso_decode_original,
+    "decode": caso_decode,
+    "codificar": caso_codificar,
+    "procesar_5": caso_procesar_5,
+    "procesar_2": caso_procesar_2,
+    "build_json": caso_build_json,
+    "json_publish": caso_json_publish,
+    "payload_json": caso_payload_json,
+    "payload_plantilla": caso_payload_plantilla,
+    "leer_archivo": caso_leer_archivo,
+    "actualizar_archivo": caso_actualizar_archivo,
+    "arranque": caso_arranque,
+    "extremo_a_extremo": caso_extremo_a_extremo,
+}
+
+
+def preparar_contexto(directorio):
+    from archivos_LIB import FileHandler
+    from tramas_LIB import TramaHandler
+
+    archivo = FileHandler(directory=directorio)
+    archivo.actualizar_archivo({"empresa": "Helpmedica", "sede": "Prueba", "area": "Piso_1"})
+    trama = TramaHandler(archivo)
+    trama.mac_local = MAC_GATEWAY
+    trama.cache_duplicados.ventana = -1  # medir el camino completo, sin supresión de duplicados
+    rnd = random.Random(8)
+
+    return {
+        "directorio": directorio,
+        "archivo": archivo,
+        "trama": trama,
+        "tramas": generar_tramas(10000),
+        "tramas_5": generar_tramas(5000, semilla=5, prob_sincro=0.0, mac_gateway=MAC_GATEWAY),
+        "tramas_2": generar_tramas(5000, semilla=6, prob_sincro=1.0),
+        "eventos": [("Rojo", generar_mac(rnd), float(rnd.randint(10, 100))) for _ in range(10000)],
+    }
+
+
+def ejecutar(casos, rondas=5):
+    """
+    Ejecuta los casos 'rondas' veces, una ronda completa tras otra, y se queda con la
+    mejor tasa de cada uno: una racha lenta de la máquina afecta a una sola ronda.
+    """
+    resultados = {}
+    with tempfile.TemporaryDirectory() as directorio:
+        with silenciar():
+            contexto = preparar_contexto(directorio)
+        for _ in range(rondas):
+            for nombre in casos:
+                with silenciar():
+                    resultado = CASOS[nombre](contexto)
+                # Un caso puede devolver (ops/s, {dato extra: valor})
+                ops, extras = resultado if isinstance(resultado, tuple) else (resultado, {})
+                if nombre not in resultados or ops > resultados[nombre]["ops_s"]:
+                    resultados[nombre] = {"ops_s": ops, "us_op": 1e6 / ops, **extras}
+        contexto["archivo"].cerrar()
+    for nombre, resultado in resultados.items():
+        detalle = "".join(f"  {clave}={valor}" for clave, valor in resultado.items() if clave not in ("ops_s", "us_op"))
+        print(f"{nombre:<20}{resultado['ops_s']:>14,.0f} ops/s{resultado['us_op']:>12.2f} us/op{detalle}")
+    return resultados
+
+
+def guardar(resultados, ruta):
+    datos = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "maquina": f"{platform.system()} {platform.machine()}",
+        "resultados": resultados,
+    }
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(datos, f, indent=2)
+    print(f"\nLínea base guardada en {ruta}")
+
+
+def comparar(resultados, ruta, umbral):
+    """
+    Compara contra una línea base guardada. Retorna la lista de casos cuya tasa cayó
+    más de 'umbral' por ciento. Los casos sin línea base se informan aparte: no se
+    pueden comparar y hay que volver a guardar la base (--guardar).
+    """
+    with open(ruta, encoding="utf-8") as f:
+        base = json.load(f)["resultados"]
+
+    regresiones = []
+    sin_base = []
+    print(f"\n{'caso':<20}{'base ops/s':>14}{'actual ops/s':>14}{'cambio':>10}")
+    for nombre, actual in resultados.items():
+        if nombre not in base:
+            sin_base.append(nombre)
+            print(f"{nombre:<20}{'-':>14}{actual['ops_s']:>14,.0f}{'':>10}  SIN LINEA BASE")
+            continue
+        anterior = base[nombre]["ops_s"]
+        cambio = (actual["ops_s"] - anterior) / anterior * 100.0
+        marca = "  REGRESION" if cambio < -umbral else ""
+        print(f"{nombre:<20}{anterior:>14,.0f}{actual['ops_s']:>14,.0f}{cambio:>+9.1f}%{marca}")
+        if marca:
+            regresiones.append(nombre)
+    if sin_base:
+        print(f"\nCasos sin línea base en {ruta}: {', '.join(sin_base)}")
+    return regresiones
+
+
+def leer_argumentos():
+    parser = argparse.ArgumentParser(description="Benchmarks del procesamiento de tramas del gateway")
+    parser.add_argument("casos", nargs="*", metavar="caso", help=f"casos a ejecutar (todos por defecto): {', '.join(CASOS)}")
+    parser.add_argument("--guardar", metavar="RUTA", help="guardar los resultados como línea base JSON")
+    parser.add_argument("--comparar", metavar="RUTA", help="comparar contra una línea base JSON")
+    parser.add_argument("--umbral", type=float, default=35.0,
+                        help="caída porcentual considerada regresión (el mismo árbol varía hasta ~30%% entre corridas)")
+    parser.add_argument("--rondas", type=int, default=5, help="rondas completas de casos; se toma la mejor de cada caso")
+    argumentos = parser.parse_args()
+    desconocidos = [caso for caso in argumentos.casos if caso not in CASOS]
+    if desconocidos:
+        parser.error(f"casos desconocidos: {', '.join(desconocidos)}")
+    return argumentos
+
+
+if __name__ == "__main__":
+    argumentos = leer_argumentos()
+    resultados = ejecutar(argumentos.casos or list(CASOS), argumentos.rondas)
+
+    if argumentos.guardar:
+        guardar(resultados, argumentos.guardar)
+
+    if argumentos.comparar:
+        regresiones = comparar(resultados, argumentos.comparar, argumentos.umbral)
+        if regresiones:
+            print(f"\nRegresiones mayores a {argumentos.umbral}%: {', '.join(regresiones)}")
+            sys.exit(1)
@@ -0,0 +1,171 @@
+import math
+import time
+import struct
+import threading
+from logs_LIB import obtener_logger
+
+log = obtener_logger("captura")
+
+# Archivo de captura: MAGIA, la MAC del gateway que capturó (ASCII, vacía si no se conoce, y "\n")
+# y luego un registro por paquete recibido:
+# instante time.monotonic (f64), RSSI en dBm (f32, NaN si no hay), largo (u16) y el paquete crudo
+MAGIA = b"LLCAP2\n"
+MAGIA_SIN_MAC = b"LLCAP1\n"  # formato anterior, sin la MAC del gateway
+REGISTRO = struct.Struct("<dfH")
+
+
+class CapturaTramas:
+    """
+    Agrega a un archivo binario cada paquete tal como lo entregó la radio (antes de
+    filtrar por ID de red), con su RSSI e instante de recepción. Escribe con buffer
+    para no frenar el callback de DIO0; se vuelca a disco cada 'intervalo_volcado' s.
+    La cabecera guarda 'mac_local': al reproducir, las tramas siguen dirigidas a ese gateway.
+    """
+    def __init__(self, ruta, mac_local=None, intervalo_volcado=1.0):
+        self.ruta = ruta
+        self.intervalo_volcado = intervalo_volcado
+        self._archivo = open(ruta, "ab")
+        if self._archivo.tell() == 0:
+            self._archivo.write(MAGIA + (mac_local or "").encode("ascii") + b"\n")
+        self._lock = threading.Lock()
+        self._ultimo_volcado = time.monotonic()
+        self.capturadas = 0
+
+    def agregar(self, paquete: bytes, rssi, instante: float):
+        registro = REGISTRO.pack(instante, math.nan if rssi is None else rssi, len(paquete)) + paquete
+        with self._lock:
+            if self._archivo is None:
+                return
+            self._archivo.write(registro)
+            self.capturadas += 1
+            if instante - self._ultimo_volcado >= self.intervalo_volcado:
+                self._archivo.flush()
+                self._ultimo_volcado = instante
+
+    def cerrar(self):
+        with self._lock:
+            if self._archivo:
+                self._archivo.close()
+                self._archivo = None
+
+
+def _abrir_captura(ruta):
+    # Retorna el archivo posicionado en el primer registro y la MAC de la cabecera
+    archivo = open(ruta, "rb")
+    magia = archivo.read(len(MAGIA))
+    if magia == MAGIA:
+        return archivo, archivo.readline(64).rstrip(b"\n").decode("ascii") or None
+    if magia == MAGIA_SIN_MAC:
+        return archivo, None
+    archivo.close()
+    raise ValueError(f"{ruta} no es un archivo de captura")
+
+
+def mac_captura(ruta):
+    """
+    MAC del gateway que hizo la captura, o None si no se guardó.
+    """
+    archivo, mac = _abrir_captura(ruta)
+    archivo.close()
+    return mac
+
+
+def leer_captura(ruta):
+    """
+    Generador de (instante, rssi, paquete) de un archivo de captura, leído de a un
+    registro: capturas de varios días no necesitan entrar en memoria.
+    """
+    archivo, _ = _abrir_captura(ruta)
+    with archivo:
+        while True:
+            cabecera = archivo.read(REGISTRO.size)
+            if len(cabecera) < REGISTRO.size:
+                return  # fin de archivo (o último registro incompleto por un corte)
+            instante, rssi, largo = REGISTRO.unpack(cabecera)
+            paquete = archivo.read(largo)
+            if len(paquete) < largo:
+                return
+            yield instante, None if math.isnan(rssi) else rssi, paquete
+
+
+class RadioReproduccion:
+    """
+    Backend de radio que reemplaza a lora_LIB.RadioRFM9x reproduciendo una captura:
+    entrega cada paquete respetando los intervalos originales divididos por
+    'velocidad' (1 = tiempo real, 10 = diez veces más rápido), o lo más rápido posible
+    con velocidad=0. A máxima velocidad espera mientras 'contrapresion()' (opcional)
+    retorne True, para medir el procesamiento y no los descartes del buffer.
+    'mac_local' es la MAC del gateway que hizo la captura (None si no se conoce).
+    """
+    def __init__(self, ruta, velocidad=1.0, contrapresion=None):
+        self.ruta = ruta
+        self.velocidad = velocidad
+        self.contrapresion = contrapresion
+        try:
+            self.mac_local = mac_captura(ruta)
+        except (OSError, ValueError) as e:
+            log.error("No se pudo leer la cabecera de %s: %s", ruta, e)
+            self.mac_local = None
+
+        # Modulación informada al planificador de transmisión (igual que RadioRFM9x)
+        self.spreading_factor = 7
+        self.ancho_banda = 125E3
+        self.tasa_codificacion = 5
+        self.preambulo = 8
+
+        self._actual = None
+        self._callback = None
+        self._detener = threading.Event()
+        self._hilo = None
+
+        self.terminado = threading.Event()
+        self.reproducidas = 0
+        self.total_enviados = 0
+        self.inicio = None
+        self.fin = None
+
+    def iniciar(self, callback):
+        self._callback = callback
+        self._detener.clear()
+        self.terminado.clear()
+        self._hilo = threading.Thread(target=self._reproducir, name="radio_reproduccion", daemon=True)
+        self._hilo.start()
+
+    def recibir(self):
+        actual, self._actual = self._actual, None
+        return actual
+
+    def enviar(self, datos: bytes):
+        self.total_enviados += 1
+
+    def cerrar(self):
+        self._detener.set()
+        if self._hilo and self._hilo is not threading.current_thread():
+            self._hilo.join(timeout=1)
+        self._hilo = None
+
+    def _reproducir(self):
+        self.inicio = time.monotonic()
+        origen = None
+        try:
+            for instante, rssi, paquete in leer_captura(self.ruta):
+                if self._detener.is_set():
+                    return
+                if origen is None:
+                    origen = instante
+                if self.velocidad > 0:
+                    espera = self.inicio + (instante - origen) / self.velocidad - time.monotonic()
+                    if espera > 0 and self._detener.wait(espera):
+                        return
+                elif self.contrapresion:
+                    while self.contrapresion() and not self._detener.is_set():
+                        time.sleep(0.001)
+                # Igual que DIO0: el callback lee el paquete con recibir()
+                self._actual = (paquete, rssi)
+                self.reproducidas += 1
+                self._callback()
+        except (OSError, ValueError) as e:
+            log.error("Error leyendo la captura %s: %s", self.ruta, e)
+        finally:
+            self.fin = time.monotonic()
+            self.terminado.set()
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import deque
+from metricas_LIB import HistogramaLatencia
+
+# Clases de prioridad (0 = más urgente) por código de acción
+PRIORIDAD_VIDA = 0        # incendio y código rojo
+PRIORIDAD_LLAMADO = 1     # llamados de enfermería y sincronización
+PRIORIDAD_TELEMETRIA = 2  # lecturas periódicas de sensores
+
+PRIORIDADES_POR_DEFECTO = {
+    'RI': PRIORIDAD_VIDA,
+    'SI': PRIORIDAD_VIDA,
+    'AA': PRIORIDAD_VIDA,
+    'FF': PRIORIDAD_LLAMADO,
+    'NN': PRIORIDAD_LLAMADO,
+    'EE': PRIORIDAD_LLAMADO,
+    'BB': PRIORIDAD_LLAMADO,
+    'BA': PRIORIDAD_LLAMADO,
+    'CC': PRIORIDAD_LLAMADO,
+    'DD': PRIORIDAD_LLAMADO,
+    'SS': PRIORIDAD_TELEMETRIA,
+    'SV': PRIORIDAD_TELEMETRIA,
+}
+
+
+class EventoTrama:
+    """
+    Resultado de procesar una trama, listo para ACK y publicación.
+    """
+    __slots__ = ("recibida", "payload", "llamado", "mac_remitente", "codigo", "bateria", "duplicado", "prioridad")
+
+    def __init__(self, recibida, payload, llamado, mac_remitente, codigo, bateria, duplicado, prioridad):
+        self.recibida = recibida
+        self.payload = payload
+        self.llamado = llamado
+        self.mac_remitente = mac_remitente
+        self.codigo = codigo
+        self.bateria = bateria
+        self.duplicado = duplicado
+        self.prioridad = prioridad
+
+
+class ColaDespacho:
+    """
+    Cola de prioridad para los eventos a despachar: sale primero la clase más urgente
+    y, dentro de cada clase, el orden de llegada. Lleva por clase la profundidad
+    actual, los descartes y un histograma del tiempo de espera en cola.
+    Con 'capacidad' eventos en cola se descarta el más reciente de la clase menos
+    urgente (el evento nuevo si no es más urgente que ella): el dispositivo no recibe
+    ACK y retransmite, y la memoria queda acotada aunque lleguen más tramas de las
+    que se alcanzan a despachar.
+    """
+    def __init__(self, prioridades=None, prioridad_por_defecto=PRIORIDAD_LLAMADO, capacidad=1024):
+        if capacidad < 1:
+            raise ValueError("La capacidad de la cola de despacho debe ser mayor que cero")
+        self.prioridades = dict(PRIORIDADES_POR_DEFECTO if prioridades is None else prioridades)
+        self.prioridad_por_defecto = prioridad_por_defecto
+        self.capacidad = capacidad
+
+        self._clases = {}   # prioridad -> deque de (instante de encolado, evento)
+        self._cantidad = 0
+        self._lock = threading.Lock()
+
+        # Métricas por clase
+        self.profundidad = {}
+        self.descartados = {}
+        self.espera = {}
+
+    def __len__(self):
+        return self._cantidad
+
+    def prioridad_de(self, codigo) -> int:
+        return self.prioridades.get(codigo, self.prioridad_por_defecto)
+
+    def agregar(self, evento, prioridad=None) -> bool:
+        """
+        Encola el evento. Retorna False si se descartó por cola llena.
+        """
+        prioridad = self.prioridad_de(evento.codigo) if prioridad is None else prioridad
+        evento.prioridad = prioridad
+        with self._lock:
+            if self._cantidad >= self.capacidad:
+                menos_urgente = max(clase for clase, eventos in self._clases.items() if eventos)
+                if prioridad >= menos_urgente:
+                    self.descartados[prioridad] = self.descartados.get(prioridad, 0) + 1
+                    return False
+                self._clases[menos_urgente].pop()
+                self.profundidad[menos_urgente] -= 1
+                self.descartados[menos_urgente] = self.descartados.get(menos_urgente, 0) + 1
+                self._cantidad -= 1
+
+            eventos = self._clases.get(prioridad)
+            if eventos is None:
+                eventos = self._clases[prioridad] = deque()
+            eventos.append((time.monotonic(), evento))
+            self.profundidad[prioridad] = self.profundidad.get(prioridad, 0) + 1
+            self._cantidad += 1
+            return True
+
+    def extraer(self):
+        """
+        Retorna el evento más urgente, o None si la cola está vacía.
+        """
+        with self._lock:
+            if not self._cantidad:
+                return None
+            prioridad = min(clase for clase, eventos in self._clases.items() if eventos)
+            encolado, evento = self._clases[prioridad].popleft()
+            self.profundidad[prioridad] -= 1
+            self._cantidad -= 1
+            histograma = self.espera.get(prioridad)
+            if histograma is None:
+                histograma = self.espera[prioridad] = HistogramaLatencia()
+        histograma.registrar(time.monotonic() - encolado)
+        return evento
+
+    def total_descartados(self) -> int:
+        return sum(self.descartados.values())
+
+    def estadisticas(self):
+        return {
+            prioridad: {
+                "profundidad": self.profundidad.get(prioridad, 0),
+                "descartados": self.descartados.get(prioridad, 0),
+                "espera": self.espera[prioridad].resumen() if prioridad in self.espera else None
+            }
+            for prioridad in sorted(set(self.profundidad) | set(self.descartados) | set(self.espera))
+        }
@@ -0,0 +1,107 @@
+import time
+from collections import OrderedDict
+
+
+class EstadoDispositivo:
+    """
+    Último estado conocido de un botón o sensor.
+    """
+    __slots__ = ("ultimo_visto", "tramas", "rssi", "bateria", "accion")
+
+    def __init__(self):
+        self.ultimo_visto = 0.0
+        self.tramas = 0
+        self.rssi = None
+        self.bateria = None
+        self.accion = None
+
+    def compacto(self):
+        return [round(self.ultimo_visto, 1), self.tramas,
+                None if self.rssi is None else round(self.rssi, 1), self.bateria, self.accion]
+
+
+class RegistroDispositivos:
+    """
+    Registro en memoria de los dispositivos por MAC remitente: última vez visto, cantidad
+    de tramas, RSSI promedio móvil (exponencial), última batería y última acción.
+    actualizar() es O(1). Se limita a 'max_dispositivos' (expulsa el menos reciente)
+    y purgar() elimina los que no se ven hace más de 'vencimiento' segundos.
+    """
+    CAMPOS = ["ultimo_visto", "tramas", "rssi", "bateria", "accion"]
+
+    def __init__(self, max_dispositivos=5000, vencimiento=86400.0, alfa_rssi=0.2):
+        self.max_dispositivos = max_dispositivos
+        self.vencimiento = vencimiento
+        self.alfa_rssi = alfa_rssi
+        self._dispositivos = OrderedDict()   # mac -> EstadoDispositivo, del menos al más reciente
+        self._modificados = set()
+        self.expulsados = 0
+
+    def __len__(self):
+        return len(self._dispositivos)
+
+    def actualizar(self, mac, rssi=None, bateria=None, accion=None, instante=None):
+        estado = self._dispositivos.get(mac)
+        if estado is None:
+            estado = self._dispositivos[mac] = EstadoDispositivo()
+            if len(self._dispositivos) > self.max_dispositivos:
+                expulsado, _ = self._dispositivos.popitem(last=False)
+                self._modificados.discard(expulsado)
+                self.expulsados += 1
+        else:
+            self._dispositivos.move_to_end(mac)
+
+        estado.ultimo_visto = time.time() if instante is None else instante
+        estado.tramas += 1
+        if rssi is not None:
+            estado.rssi = rssi if estado.rssi is None else estado.rssi + self.alfa_rssi * (rssi - estado.rssi)
+        if bateria is not None:
+            estado.bateria = bateria
+        if accion is not None:
+            estado.accion = accion
+        self._modificados.add(mac)
+
+    def obtener(self, mac):
+        return self._dispositivos.get(mac)
+
+    def purgar(self, instante=None):
+        """
+        Elimina los dispositivos sin tramas en los últimos 'vencimiento' segundos.
+        """
+        limite = (time.time() if instante is None else instante) - self.vencimiento
+        purgados = 0
+        while self._dispositivos:
+            mac, estado = next(iter(self._dispositivos.items()))
+            if estado.ultimo_visto >= limite:
+                break
+            del self._dispositivos[mac]
+            self._modificados.discard(mac)
+            purgados += 1
+        return purgados
+
+    def instantanea(self):
+        """
+        Payload compacto con todos los dispositivos: {"campos": [...], "dispositivos": {mac: [...]}}.
+        """
+        self._modificados.clear()
+        return {
+            "tipo": "completo",
+            "campos": self.CAMPOS,
+            "dispositivos": {mac: estado.compacto() for mac, estado in self._dispositivos.items()}
+        }
+
+    def delta(self):
+        """
+        Payload compacto solo con los dispositivos modificados desde la última instantánea o delta.
+        Retorna None si no hubo cambios.
+        """
+        if not self._modificados:
+            return None
+        modificados, self._modificados = self._modificados, set()
+        return {
+            "tipo": "delta",
+            "campos": self.CAMPOS,
+            "dispositivos": {
+                mac: self._dispositivos[mac].compacto() for mac in modificados if mac in self._dispositivos
+            }
+        }
@@ -0,0 +1,360 @@
+import re
+import time
+import queue
+import socket
+import struct
+import threading
+import socketserver
+from collections import deque
+from lora_LIB import TramaRecibida
+from archivos_LIB import FileHandler
+from tramas_LIB import TramaHandler, lecturas_sensor
+from despacho_LIB import PRIORIDADES_POR_DEFECTO, PRIORIDAD_LLAMADO, PRIORIDAD_TELEMETRIA
+from telemetria_LIB import AgregadorTelemetria
+from dispositivos_LIB import RegistroDispositivos
+from logs_LIB import obtener_logger
+
+log = obtener_logger("distribuido")
+
+# Cada trama reenviada viaja como: largo (2 bytes, big endian) + "nodo\trssi\tpayload" en UTF-8
+CABECERA = struct.Struct(">H")
+
+
+def empaquetar(nodo: str, recibida) -> bytes:
+    rssi = "" if recibida.rssi is None else f"{recibida.rssi:.1f}"
+    cuerpo = f"{nodo}\t{rssi}\t{recibida.payload}".encode("utf-8")
+    return CABECERA.pack(len(cuerpo)) + cuerpo
+
+
+def desempaquetar(cuerpo: bytes):
+    """
+    Retorna (nodo, TramaRecibida) con el instante de llegada al procesador central.
+    """
+    nodo, rssi, payload = cuerpo.decode("utf-8").split("\t", 2)
+    return nodo, TramaRecibida(payload, float(rssi) if rssi else None, time.monotonic())
+
+
+class ReenviadorNodo:
+    """
+    Lado del nodo de radio: reenvía las tramas crudas (ya confirmadas con ACK por LoRa)
+    al procesador central por TCP. enviar() nunca bloquea: las tramas esperan en una
+    cola acotada mientras no hay conexión y un hilo propio las entrega y reconecta.
+    Si la cola se llena se descarta la más antigua.
+    """
+    def __init__(self, host: str, puerto: int, nodo: str, capacidad=10000, intervalo_reintento=2.0):
+        self.host = host
+        self.puerto = puerto
+        self.nodo = nodo
+        self.intervalo_reintento = intervalo_reintento
+
+        self._pendientes = deque(maxlen=capacidad)
+        self._aviso = threading.Event()
+        self._detener = threading.Event()
+        self._socket = None
+        self._hilo = None
+
+        # Estadísticas
+        self.conectado = False
+        self.enviadas = 0
+        self.descartadas = 0
+
+    def iniciar(self):
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._ejecutar, name="reenviador_nodo", daemon=True)
+        self._hilo.start()
+
+    def enviar(self, recibida):
+        if len(self._pendientes) == self._pendientes.maxlen:
+            self.descartadas += 1
+        self._pendientes.append(recibida)
+        self._aviso.set()
+
+    def _ejecutar(self):
+        while not self._detener.is_set():
+            if self._socket is None and not self._conectar():
+                self._detener.wait(self.intervalo_reintento)
+                continue
+            self._aviso.wait(1.0)
+            self._aviso.clear()
+            while self._pendientes and not self._detener.is_set():
+                recibida = self._pendientes.popleft()
+                try:
+                    self._socket.sendall(empaquetar(self.nodo, recibida))
+                    self.enviadas += 1
+                except OSError as e:
+                    # Se reintenta; el central descarta la repetición con su caché de duplicados
+                    self._pendientes.appendleft(recibida)
+                    log.warning("Conexión con el procesador central perdida: %s", e)
+                    self._cerrar_socket()
+                    break
+        self._cerrar_socket()
+
+    def _conectar(self) -> bool:
+        try:
+            self._socket = socket.create_connection((self.host, self.puerto), timeout=5.0)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.conectado = True
+            log.info("Conectado al procesador central %s:%s", self.host, self.puerto)
+            return True
+        except OSError as e:
+            log.debug("No se pudo conectar al procesador central: %s", e)
+            return False
+
+    def _cerrar_socket(self):
+        if self._socket:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = None
+        self.conectado = False
+
+    def cerrar(self):
+        self._detener.set()
+        self._aviso.set()
+        if self._hilo:
+            self._hilo.join(timeout=2)
+            self._hilo = None
+
+    def estadisticas(self):
+        return {
+            "conectado": self.conectado,
+            "pendientes": len(self._pendientes),
+            "enviadas": self.enviadas,
+            "descartadas": self.descartadas
+        }
+
+
+class _ManejadorConexion(socketserver.BaseRequestHandler):
+    def handle(self):
+        lector = self.request.makefile("rb")
+        while True:
+            cabecera = lector.read(CABECERA.size)
+            if len(cabecera) < CABECERA.size:
+                return
+            cuerpo = lector.read(CABECERA.unpack(cabecera)[0])
+            try:
+                nodo, recibida = desempaquetar(cuerpo)
+            except ValueError as e:
+                log.warning("Trama reenviada inválida desde %s: %s", self.client_address, e)
+                continue
+            self.server.al_recibir(nodo, recibida)
+
+
+class ServidorNodos(socketserver.ThreadingTCPServer):
+    """
+    Servidor TCP del procesador central: un hilo por nodo de radio conectado que
+    llama a al_recibir(nodo, TramaRecibida) por cada trama.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, puerto: int, al_recibir, host: str = "0.0.0.0"):
+        super().__init__((host, puerto), _ManejadorConexion)
+        self.al_recibir = al_recibir
+
+
+class ContextoNodo:
+    """
+    Estado por nodo de radio en el procesador central: su archivo de configuración
+    (empresa/sede/área), su TramaHandler (con su caché de duplicados), su agregador de
+    telemetría, su registro de dispositivos y sus tópicos.
+    Las claves vacías o ausentes del archivo del nodo se completan con 'configuracion'
+    (la del central): un nodo nuevo publica bajo la empresa y el área del central
+    hasta que su bajada le asigne otras.
+    """
+    def __init__(self, nodo, directorio, metricas=None, configuracion=None):
+        self.nodo = nodo
+        self.archivo = FileHandler(file_name=f"configuracion_{re.sub(r'[^0-9A-Za-z]', '', nodo)}.csv", directory=directorio)
+        if configuracion:
+            actual = self.archivo.obtener_configuracion()
+            faltantes = {clave: valor for clave, valor in configuracion.items() if valor and not actual.get(clave)}
+            if faltantes:
+                self.archivo.actualizar_archivo(faltantes)
+        self.trama = TramaHandler(self.archivo, metricas=metricas)
+        self.trama.mac_local = nodo  # las tramas van dirigidas a la MAC del nodo
+        self.agregador = AgregadorTelemetria()
+        self.registro = RegistroDispositivos()
+        self.topic_base = None
+        self.topic_bajada = None
+
+
+class ProcesadorCentral:
+    """
+    Procesa las tramas de todos los nodos de radio con 'hilos' hilos de trabajo y las
+    deja en la bandeja de salida compartida (publicada por una única conexión MQTT).
+    Las tramas de un mismo nodo siempre van al mismo hilo, así se procesan en orden y
+    cada TramaHandler se usa desde un solo hilo. Cada nodo publica bajo el tópico de
+    su propia configuración y recibe su bajada en '{empresa}/{area}/{nodo}/down'.
+    La telemetría agregada y el estado de los dispositivos de cada nodo también se
+    publican desde su hilo, cuando el lazo principal lo pide con revisar().
+    """
+    def __init__(self, puerto, directorio, bandeja, mqtt, hilos=4, capacidad_cola=10000, aviso=None, metricas=None,
+                 archivo_base=None):
+        self.directorio = directorio
+        self.archivo_base = archivo_base  # FileHandler del central: configuración inicial de cada nodo
+        self.bandeja = bandeja
+        self.mqtt = mqtt
+        self.aviso = aviso
+        self.metricas = metricas
+
+        self.nodos = {}
+        self._por_topico = {}   # tópico de bajada -> nodo
+        self._lock = threading.Lock()
+        self._colas = [queue.Queue(maxsize=capacidad_cola) for _ in range(hilos)]
+        self._hilos = []
+        self._servidor = ServidorNodos(puerto, self.recibir)
+
+        # Estadísticas
+        self.recibidas = 0
+        self.descartadas = 0
+        self.encoladas = 0
+
+    def iniciar(self):
+        for indice, cola in enumerate(self._colas):
+            hilo = threading.Thread(target=self._trabajar, args=(cola,), name=f"central_{indice}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+        threading.Thread(target=self._servidor.serve_forever, name="servidor_nodos", daemon=True).start()
+        log.info("Procesador central escuchando nodos en el puerto %s", self._servidor.server_address[1])
+
+    def detener(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+        self.revisar(forzar=True)  # guardar en la bandeja las ventanas de telemetría abiertas
+        for cola in self._colas:
+            cola.put(None)
+        for hilo in self._hilos:
+            hilo.join(timeout=2)
+        self._hilos = []
+        for contexto in self.nodos.values():
+            contexto.archivo.cerrar()
+
+    def _cola_de(self, nodo):
+        return self._colas[hash(nodo) % len(self._colas)]
+
+    def recibir(self, nodo, recibida):
+        self.recibidas += 1
+        try:
+            self._cola_de(nodo).put_nowait((nodo, recibida, None))
+        except queue.Full:
+            self.descartadas += 1
+
+    def aplicar_bajada(self, topic, mensaje) -> bool:
+        """
+        Entrega un mensaje de configuración al nodo dueño de 'topic'. Se aplica en el
+        hilo del nodo, entre sus tramas. Retorna False si el tópico no es de ningún nodo.
+        """
+        nodo = self._por_topico.get(topic)
+        if nodo is None:
+            return False
+        self._cola_de(nodo).put((nodo, None, mensaje))
+        return True
+
+    def revisar(self, estado=False, completo=False, forzar=False):
+        """
+        Pide a cada hilo publicar las ventanas de telemetría vencidas de sus nodos (todas
+        si forzar=True) y, con estado=True, el estado de sus dispositivos en
+        '{topic_base}/{nodo}/dispositivos' (completo o solo los modificados).
+        """
+        for cola in self._colas:
+            try:
+                cola.put((None, None, (estado, completo, forzar)), block=forzar)
+            except queue.Full:
+                pass  # hilo atrasado: se revisa en la próxima vuelta
+
+    def _contexto(self, nodo):
+        contexto = self.nodos.get(nodo)
+        if contexto is None:
+            configuracion = self.archivo_base.obtener_configuracion() if self.archivo_base else None
+            contexto = ContextoNodo(nodo, self.directorio, self.metricas, configuracion)
+            with self._lock:
+                self.nodos[nodo] = contexto
+            contexto.archivo.suscribir(lambda configuracion: self._actualizar_topicos(contexto, configuracion))
+            log.info("Nuevo nodo de radio: %s", nodo)
+        return contexto
+
+    def _actualizar_topicos(self, contexto, configuracion):
+        empresa, area = configuracion.get("empresa"), configuracion.get("area")
+        contexto.topic_base = f"{empresa}/{area}"
+        topic_bajada = f"{empresa}/{area}/{contexto.nodo}/down"
+        if topic_bajada == contexto.topic_bajada:
+            return
+        if contexto.topic_bajada:
+            self._por_topico.pop(contexto.topic_bajada, None)
+            self.mqtt.unsubscribe(contexto.topic_bajada)
+        self._por_topico[topic_bajada] = contexto.nodo
+        contexto.topic_bajada = topic_bajada
+        self.mqtt.subscribe(topic_bajada)
+
+    def _trabajar(self, cola):
+        while True:
+            elemento = cola.get()
+            if elemento is None:
+                return
+            nodo, recibida, mensaje = elemento
+            if nodo is None:
+                self._revisar_nodos(cola, *mensaje)
+                continue
+            try:
+                contexto = self._contexto(nodo)
+                if mensaje is not None:
+                    contexto.archivo.actualizar_archivo(mensaje)
+                else:
+                    self._procesar(contexto, recibida)
+            except Exception as e:
+                log.error("Error procesando trama del nodo %s: %s: %s", nodo, type(e).__name__, e)
+
+    def _procesar(self, contexto, recibida):
+        if self.metricas:
+            self.metricas.registrar_desde("espera_rx", recibida.timestamp)
+        trama = contexto.trama
+        payload = trama.procesar(recibida.payload)
+        if payload is None:
+            return
+        # El RSSI es el que midió el nodo al recibir la trama
+        contexto.registro.actualizar(trama.mac_remitente, recibida.rssi, trama.bateria, trama.codigo)
+        # Las sincronizaciones las responde el nodo; los duplicados ya se confirmaron allá
+        if trama.llamado_text == "sincro" or trama.duplicado:
+            return
+        if trama.codigo in contexto.agregador.codigos:
+            lecturas = lecturas_sensor(trama.bateria)
+            if contexto.agregador.agregar(trama.codigo, trama.mac_remitente, payload, lecturas) is None:
+                return
+        prioridad = PRIORIDADES_POR_DEFECTO.get(trama.codigo, PRIORIDAD_LLAMADO)
+        self._publicar(f"{contexto.topic_base}/{trama.mac_remitente}/up", payload, prioridad)
+
+    def _revisar_nodos(self, cola, estado, completo, forzar):
+        # Solo los nodos de este hilo: sus agregadores y registros no se tocan desde otro
+        for contexto in list(self.nodos.values()):
+            if self._cola_de(contexto.nodo) is not cola:
+                continue
+            try:
+                for mac, payload in contexto.agregador.vencidos(forzar=forzar):
+                    self._publicar(f"{contexto.topic_base}/{mac}/up", payload, PRIORIDAD_TELEMETRIA)
+                if not estado:
+                    continue
+                if completo:
+                    contexto.registro.purgar()
+                    payload = contexto.registro.instantanea()
+                else:
+                    payload = contexto.registro.delta()
+                if payload is not None and payload["dispositivos"]:
+                    self._publicar(f"{contexto.topic_base}/{contexto.nodo}/dispositivos", payload, PRIORIDAD_TELEMETRIA)
+            except Exception as e:
+                log.error("Error revisando el nodo %s: %s: %s", contexto.nodo, type(e).__name__, e)
+
+    def _publicar(self, topic, payload, prioridad):
+        self.bandeja.agregar(topic, payload, prioridad)
+        self.encoladas += 1
+        if self.aviso:
+            self.aviso.set()
+
+    def estadisticas(self):
+        return {
+            "nodos": len(self.nodos),
+            "recibidas": self.recibidas,
+            "descartadas": self.descartadas,
+            "encoladas": self.encoladas,
+            "en_cola": sum(cola.qsize() for cola in self._colas)
+        }
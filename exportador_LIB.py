@@ -0,0 +1,89 @@
+import os
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logs_LIB import obtener_logger
+
+log = obtener_logger("exportador")
+
+# Prefijo de los nombres en el formato de texto de Prometheus
+PREFIJO = "gateway_"
+
+
+def memoria_residente():
+    """
+    Memoria residente (RSS) del proceso en bytes, leída de /proc (Linux). None si no se puede leer.
+    """
+    try:
+        with open("/proc/self/statm") as archivo:
+            return int(archivo.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def texto_prometheus(metricas) -> str:
+    """
+    Formato de texto de Prometheus para una lista de (nombre, tipo, ayuda, valor).
+    Las métricas con valor None (p. ej. sin radio en el procesador central) se omiten.
+    """
+    lineas = []
+    for nombre, tipo, ayuda, valor in metricas:
+        if valor is None:
+            continue
+        nombre = PREFIJO + nombre
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        lineas.append(f"{nombre} {int(valor) if isinstance(valor, bool) else valor}")
+    return "\n".join(lineas) + "\n"
+
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        ruta = self.path.split("?", 1)[0]
+        if ruta not in ("/metrics", "/metrics.json"):
+            self.send_error(404)
+            return
+        try:
+            metricas = self.server.recolectar()
+        except Exception as e:
+            log.error("Error recolectando métricas: %s: %s", type(e).__name__, e)
+            self.send_error(500)
+            return
+
+        if ruta == "/metrics":
+            cuerpo = texto_prometheus(metricas).encode("utf-8")
+            tipo = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            cuerpo = json.dumps({nombre: valor for nombre, _, _, valor in metricas}).encode("utf-8")
+            tipo = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        log.debug("%s - " + formato, self.client_address[0], *args)
+
+
+class ServidorMetricas(ThreadingHTTPServer):
+    """
+    Endpoint HTTP de métricas del gateway: GET /metrics (texto de Prometheus) y
+    GET /metrics.json. 'recolectar()' retorna una lista de (nombre, tipo, ayuda, valor)
+    y se llama solo en cada consulta: los contadores siguen siendo enteros comunes que
+    se incrementan sin locks extra en el callback de la radio ni en MQTT.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, puerto: int, recolectar, host: str = "127.0.0.1"):
+        super().__init__((host, puerto), _ManejadorMetricas)
+        self.recolectar = recolectar
+
+    def iniciar(self):
+        threading.Thread(target=self.serve_forever, name="servidor_metricas", daemon=True).start()
+        log.info("Métricas en http://%s:%s/metrics", *self.server_address[:2])
+
+    def detener(self):
+        self.shutdown()
+        self.server_close()
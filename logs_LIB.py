@@ -0,0 +1,79 @@
+import sys
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+RAIZ = "llamado"
+FORMATO = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+_listener = None
+
+
+def obtener_logger(componente):
+    """
+    Logger de un componente del gateway ('lora', 'mqtt', ...), hijo de 'llamado'.
+    Usar formato perezoso: log.debug("RSSI %s dBm", rssi), así los mensajes que no
+    superan el nivel configurado no se formatean.
+    """
+    return logging.getLogger(f"{RAIZ}.{componente}")
+
+
+class ManejadorCola(QueueHandler):
+    """
+    QueueHandler que nunca bloquea: si la cola está llena descarta el registro y lo
+    cuenta en 'descartados'. El formateo se hace en el hilo del QueueListener.
+    """
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def prepare(self, record):
+        # Solo el traceback se resuelve aquí (no puede viajar a otro hilo sin formatear)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def configurar_logs(debug=False, en_cola=True, capacidad_cola=10000, salida=None):
+    """
+    Configura los logs del gateway. Por defecto solo se emiten INFO y superiores
+    (arranque, conexiones, reportes y errores); con debug=True se registra cada trama
+    como antes. Con en_cola=True la escritura a 'salida' (stdout por defecto) la hace
+    un hilo en segundo plano y el lazo de radio nunca espera a la consola.
+    """
+    global _listener
+    detener_logs()
+
+    raiz = logging.getLogger(RAIZ)
+    raiz.setLevel(logging.DEBUG if debug else logging.INFO)
+    raiz.propagate = False
+    for manejador in list(raiz.handlers):
+        raiz.removeHandler(manejador)
+
+    consola = logging.StreamHandler(salida or sys.stdout)
+    consola.setFormatter(logging.Formatter(FORMATO))
+    if en_cola:
+        manejador = ManejadorCola(queue.Queue(maxsize=capacidad_cola))
+        _listener = QueueListener(manejador.queue, consola)
+        _listener.start()
+    else:
+        manejador = consola
+    raiz.addHandler(manejador)
+    return manejador
+
+
+def detener_logs():
+    """
+    Vacía los registros pendientes en la cola y detiene el hilo escritor.
+    """
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
@@ -1,25 +1,257 @@
-import board
-import busio
-import digitalio
-import adafruit_rfm9x
+import math
 import time
-from gpiozero import DigitalInputDevice
+import threading
+import itertools
+from collections import namedtuple, OrderedDict, deque
+from metricas_LIB import HistogramaLatencia
+from logs_LIB import obtener_logger
 
-class LoRaHandler:
-    def __init__(self, id_red="0x12", frecuencia_mhz=915.0):
-        # Configuración de red y radio
-        self.id_red = id_red
+log = obtener_logger("lora")
+
+
+# Trama recibida por radio: payload sin cabecera de red, RSSI y instante de recepción (time.monotonic)
+TramaRecibida = namedtuple("TramaRecibida", ["payload", "rssi", "timestamp"])
+
+
+class BufferRecepcion:
+    """
+    Buffer circular acotado y thread-safe para las tramas recibidas.
+    El callback de DIO0 agrega tramas y el lazo principal las extrae todas juntas.
+    Si el buffer está lleno se descarta la trama entrante (el dispositivo no recibe
+    ACK y la retransmite) y se incrementa el contador de descartes.
+    """
+    def __init__(self, capacidad=256):
+        if capacidad < 1:
+            raise ValueError("La capacidad del buffer debe ser mayor que cero")
+        self.capacidad = capacidad
+        self._slots = [None] * capacidad
+        self._inicio = 0
+        self._cantidad = 0
+        self._lock = threading.Lock()
+
+        # Estadísticas
+        self.total_recibidas = 0
+        self.descartadas = 0
+        self.maximo_ocupado = 0
+
+    def __len__(self):
+        return self._cantidad
+
+    def agregar(self, trama):
+        """
+        Agrega una trama al final del buffer. Retorna False si se descartó por buffer lleno.
+        """
+        with self._lock:
+            self.total_recibidas += 1
+            if self._cantidad == self.capacidad:
+                self.descartadas += 1
+                return False
+            self._slots[(self._inicio + self._cantidad) % self.capacidad] = trama
+            self._cantidad += 1
+            if self._cantidad > self.maximo_ocupado:
+                self.maximo_ocupado = self._cantidad
+            return True
+
+    def extraer_todo(self):
+        """
+        Extrae y devuelve en orden de llegada todas las tramas pendientes.
+        """
+        with self._lock:
+            pendientes = []
+            for i in range(self._cantidad):
+                indice = (self._inicio + i) % self.capacidad
+                pendientes.append(self._slots[indice])
+                self._slots[indice] = None
+            self._inicio = (self._inicio + self._cantidad) % self.capacidad
+            self._cantidad = 0
+            return pendientes
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "pendientes": self._cantidad,
+                "capacidad": self.capacidad,
+                "total_recibidas": self.total_recibidas,
+                "descartadas": self.descartadas,
+                "maximo_ocupado": self.maximo_ocupado
+            }
+
+
+# Bytes que agrega la librería RFM9x (cabecera RadioHead: destino, nodo, identificador y flags)
+CABECERA_RADIOHEAD = 4
+
+
+def tiempo_en_aire(largo, spreading_factor=7, ancho_banda=125E3, tasa_codificacion=5, preambulo=8, crc=True):
+    """
+    Tiempo en el aire (s) de un paquete LoRa de 'largo' bytes con cabecera explícita,
+    según la fórmula de la hoja de datos del SX1276. 'tasa_codificacion' es el
+    denominador de 4/5..4/8.
+    """
+    simbolo = (2 ** spreading_factor) / ancho_banda
+    # Optimización de baja tasa obligatoria con símbolos de más de 16 ms (SF11/SF12 a 125 kHz)
+    baja_tasa = 1 if simbolo > 0.016 else 0
+    numerador = 8 * largo - 4 * spreading_factor + 28 + (16 if crc else 0)
+    simbolos_payload = 8 + max(
+        math.ceil(numerador / (4 * (spreading_factor - 2 * baja_tasa))) * tasa_codificacion, 0)
+    return (preambulo + 4.25) * simbolo + simbolos_payload * simbolo
+
+
+class PlanificadorTX:
+    """
+    Cola de transmisión de la radio. Las tramas se encolan durante el despacho y se
+    transmiten juntas con transmitir_pendientes(), así la radio (half-duplex) vuelve
+    a escuchar cuanto antes.
+    - Tramas con la misma 'clave' (p. ej. el ACK a un mismo dispositivo) se fusionan:
+      se transmite solo la última, en la posición de la primera.
+    - Se respeta un ciclo de trabajo: como máximo 'ciclo_trabajo' * 'ventana' segundos de
+      aire en cualquier ventana deslizante de 'ventana' segundos (None = sin límite).
+    - Las tramas que esperan más de 'max_espera' segundos se descartan (el dispositivo
+      no recibe ACK y retransmite).
+    - Con 'metricas' (metricas_LIB.MetricasLatencia) registra al transmitir las etapas
+      'ack' (desde que se encoló) y 'total_ack' (desde la recepción de la trama que responde).
+    """
+    def __init__(self, radio, ciclo_trabajo=0.1, ventana=3600.0, max_espera=2.0, metricas=None):
+        self.radio = radio
+        self.metricas = metricas
+        self.ciclo_trabajo = ciclo_trabajo
+        self.ventana = ventana
+        self.max_espera = max_espera
+
+        self._pendientes = OrderedDict()   # clave -> [datos, instante de encolado, instante de recepción]
+        self._secuencia = itertools.count()
+        self._historial = deque()          # (instante de transmisión, tiempo en aire)
+        self._aire_en_ventana = 0.0
+        self._inicio = time.monotonic()
+
+        # Estadísticas
+        self.enviadas = 0
+        self.fusionadas = 0
+        self.vencidas = 0
+        self.errores = 0
+        self.aire_total = 0.0
+        self.espera = HistogramaLatencia()
+
+    def __len__(self):
+        return len(self._pendientes)
+
+    def tiempo_en_aire(self, datos: bytes) -> float:
+        radio = self.radio
+        return tiempo_en_aire(
+            len(datos) + CABECERA_RADIOHEAD, radio.spreading_factor, radio.ancho_banda,
+            radio.tasa_codificacion, radio.preambulo)
+
+    def encolar(self, datos: bytes, clave=None, recibido=None):
+        """
+        'recibido' (time.monotonic, opcional) es la recepción de la trama que se responde.
+        """
+        if clave is None:
+            clave = next(self._secuencia)
+        pendiente = self._pendientes.get(clave)
+        if pendiente is not None:
+            pendiente[0] = datos
+            self.fusionadas += 1
+            return
+        self._pendientes[clave] = [datos, time.monotonic(), recibido]
+
+    def _liberar_ventana(self, instante):
+        limite = instante - self.ventana
+        while self._historial and self._historial[0][0] <= limite:
+            self._aire_en_ventana -= self._historial.popleft()[1]
+
+    def _disponible_desde(self, aire, instante):
+        """
+        Instante a partir del cual 'aire' segundos entran en el presupuesto del ciclo de trabajo.
+        """
+        if self.ciclo_trabajo is None:
+            return instante
+        excedente = self._aire_en_ventana + aire - self.ciclo_trabajo * self.ventana
+        if excedente <= 0:
+            return instante
+        for transmitido, duracion in self._historial:
+            excedente -= duracion
+            if excedente <= 0:
+                return transmitido + self.ventana
+        return instante + self.ventana
+
+    def transmitir_pendientes(self):
+        """
+        Transmite en orden las tramas encoladas que entran en el presupuesto.
+        Retorna el instante (time.monotonic) en que conviene volver a intentar, o None
+        si la cola quedó vacía.
+        """
+        while self._pendientes:
+            clave, (datos, encolado, recibido) = next(iter(self._pendientes.items()))
+            instante = time.monotonic()
+            if instante - encolado > self.max_espera:
+                del self._pendientes[clave]
+                self.vencidas += 1
+                continue
+
+            self._liberar_ventana(instante)
+            aire = self.tiempo_en_aire(datos)
+            disponible = self._disponible_desde(aire, instante)
+            if disponible > instante:
+                return min(disponible, encolado + self.max_espera)
+
+            del self._pendientes[clave]
+            try:
+                self.radio.enviar(datos)
+            except Exception as e:
+                self.errores += 1
+                log.error("Error al enviar: %s: %s", type(e).__name__, e)
+                continue
+
+            log.debug("Enviado: %s (%.1f ms en el aire)", datos, aire * 1000)
+            self._historial.append((instante, aire))
+            self._aire_en_ventana += aire
+            self.aire_total += aire
+            self.enviadas += 1
+            self.espera.registrar(instante - encolado)
+            if self.metricas:
+                self.metricas.registrar_desde("ack", encolado)
+                if recibido is not None:
+                    self.metricas.registrar_desde("total_ack", recibido)
+        return None
+
+    def descartar_pendientes(self):
+        self._pendientes.clear()
+
+    def estadisticas(self):
+        instante = time.monotonic()
+        self._liberar_ventana(instante)
+        ventana = max(min(self.ventana, instante - self._inicio), 1.0)
+        return {
+            "pendientes": len(self._pendientes),
+            "enviadas": self.enviadas,
+            "fusionadas": self.fusionadas,
+            "vencidas": self.vencidas,
+            "errores": self.errores,
+            "aire_total_s": round(self.aire_total, 3),
+            "utilizacion": self._aire_en_ventana / ventana,
+            "ciclo_trabajo": self.ciclo_trabajo,
+            "espera": self.espera.resumen()
+        }
+
+
+class RadioRFM9x:
+    """
+    Backend de radio para el módulo RFM9x conectado por SPI a la Raspberry Pi.
+    Las librerías de hardware se importan al iniciar, así el resto del gateway
+    puede importarse en equipos sin GPIO (ver simulacion_LIB.RadioSimulada).
+    """
+    def __init__(self, frecuencia_mhz=915.0, spreading_factor=7, ancho_banda=125E3, tasa_codificacion=5, preambulo=8):
         self.frecuencia_mhz = frecuencia_mhz
 
+        # Modulación (también la usa PlanificadorTX para calcular el tiempo en el aire)
+        self.spreading_factor = spreading_factor
+        self.ancho_banda = ancho_banda
+        self.tasa_codificacion = tasa_codificacion  # 4/5
+        self.preambulo = preambulo
+
         # Pines según guía del módulo LoRa para Raspberry Pi
         self.pin_dio = 5              # GPIO 5
-        self.pin_cs = board.CE0       # CE0 (GPIO 7)
-        self.pin_reset = board.D25    # GPIO 25
-
-        # Estados internos
-        self.lora_inicializado = False
-        self.paquete_recibido = False
-        self.mensaje_recibido = ""
+        self.pin_cs = None            # CE0 (GPIO 7)
+        self.pin_reset = None         # GPIO 25
 
         # Objetos hardware
         self.rfm9x = None
@@ -28,30 +260,68 @@ class LoRaHandler:
         self.reset = None
         self.dio0 = None
 
-    # --- Callback cuando hay recepción ---
-    def rx_callback(self):
-        if self.rfm9x.rx_done:
-            paquete = self.rfm9x.receive(timeout=None)
-            if paquete:
-                try:
-                    mensaje = paquete.decode("ascii", errors="replace")
-                    print("\n--- Paquete recibido ---")
-                    print(f"Mensaje bruto: {mensaje}")
-
-                    if mensaje.startswith(f"{self.id_red}:"):
-                        self.mensaje_recibido = mensaje.split(":", 1)[1]
-                        print(f"Mensaje válido recibido")
-                        print(f"RSSI: {self.rfm9x.last_rssi} dBm")
-                        self.paquete_recibido = True
-                    else:
-                        print("Mensaje recibido con ID inválido")
-
-                except UnicodeDecodeError as e:
-                    print(f"Error de decodificación: {e}")
-
-                print("-------------------------")
+    def iniciar(self, callback):
+        """
+        Configura el módulo, asocia 'callback' a la interrupción DIO0 y comienza a escuchar.
+        """
+        import board
+        import busio
+        import digitalio
+        import adafruit_rfm9x
+        from gpiozero import DigitalInputDevice
+
+        self.pin_cs = board.CE0
+        self.pin_reset = board.D25
+
+        # Inicializar pines CS y RESET
+        self.cs = digitalio.DigitalInOut(self.pin_cs)
+        self.cs.direction = digitalio.Direction.OUTPUT
+
+        self.reset = digitalio.DigitalInOut(self.pin_reset)
+        self.reset.direction = digitalio.Direction.OUTPUT
+
+        # Resetear físicamente el módulo LoRa
+        self.reset.value = False
+        time.sleep(0.1)
+        self.reset.value = True
+        time.sleep(0.1)
+
+        # Inicializar SPI
+        self.spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
+
+        # Inicializar módulo RFM9x
+        self.rfm9x = adafruit_rfm9x.RFM9x(
+            self.spi, self.cs, self.reset, self.frecuencia_mhz, baudrate=1000000)
+
+        # Configurar parámetros LoRa
+        self.rfm9x.spreading_factor = self.spreading_factor
+        self.rfm9x.signal_bandwidth = self.ancho_banda
+        self.rfm9x.coding_rate = self.tasa_codificacion
+        self.rfm9x.preamble_length = self.preambulo
+        self.rfm9x.enable_crc = True
+        self.rfm9x.tx_power = 14
+
+        # Configurar interrupción DIO0
+        self.dio0 = DigitalInputDevice(self.pin_dio, pull_up=False)
+        self.dio0.when_activated = callback
+
+        # Comenzar a escuchar
+        self.rfm9x.listen()
+
+    def recibir(self):
+        """
+        Retorna (paquete, rssi) si hay un paquete recibido, o None.
+        """
+        if not self.rfm9x.rx_done:
+            return None
+        paquete = self.rfm9x.receive(timeout=None)
+        if not paquete:
+            return None
+        return paquete, self.rfm9x.last_rssi
+
+    def enviar(self, datos: bytes):
+        self.rfm9x.send(datos, keep_listening=True)
 
-    # --- Liberar recursos ---
     def cerrar(self):
         if self.dio0:
             self.dio0.close()
@@ -66,6 +336,64 @@ class LoRaHandler:
             self.spi.deinit()
             self.spi = None
         self.rfm9x = None
+
+
+class LoRaHandler:
+    def __init__(self, id_red="0x12", frecuencia_mhz=915.0, capacidad_buffer=256, radio=None, ciclo_trabajo=0.1, metricas=None):
+        # Configuración de red y radio
+        self.id_red = id_red
+        self.frecuencia_mhz = frecuencia_mhz
+
+        # Backend de radio: RFM9x real por defecto, o uno simulado para pruebas de carga
+        self.radio = radio if radio else RadioRFM9x(frecuencia_mhz)
+
+        # Estados internos
+        self.lora_inicializado = False
+        self.buffer_rx = BufferRecepcion(capacidad_buffer)
+        self.planificador_tx = PlanificadorTX(self.radio, ciclo_trabajo=ciclo_trabajo, metricas=metricas)
+
+        # threading.Event opcional que se activa con cada trama recibida (despierta al lazo principal)
+        self.aviso = None
+
+        # captura_LIB.CapturaTramas opcional que guarda cada paquete crudo recibido
+        self.captura = None
+
+    @property
+    def paquete_recibido(self):
+        return len(self.buffer_rx) > 0
+
+    # --- Extraer todas las tramas pendientes ---
+    def extraer_pendientes(self):
+        return self.buffer_rx.extraer_todo()
+
+    # --- Callback cuando hay recepción ---
+    def rx_callback(self):
+        recepcion = self.radio.recibir()
+        if recepcion:
+            paquete, rssi = recepcion
+            instante = time.monotonic()
+            if self.captura:
+                self.captura.agregar(paquete, rssi, instante)
+            try:
+                mensaje = paquete.decode("ascii", errors="replace")
+
+                if mensaje.startswith(f"{self.id_red}:"):
+                    log.debug("Paquete recibido: %s (RSSI %s dBm)", mensaje, rssi)
+                    recibida = TramaRecibida(mensaje.split(":", 1)[1], rssi, instante)
+                    if not self.buffer_rx.agregar(recibida):
+                        log.warning("Buffer de recepción lleno, trama descartada")
+                    if self.aviso:
+                        self.aviso.set()
+                else:
+                    log.debug("Paquete con ID de red inválido: %s (RSSI %s dBm)", mensaje, rssi)
+
+            except UnicodeDecodeError as e:
+                log.warning("Error de decodificación: %s", e)
+
+    # --- Liberar recursos ---
+    def cerrar(self):
+        self.planificador_tx.descartar_pendientes()
+        self.radio.cerrar()
         self.lora_inicializado = False
 
     # --- Inicializar LoRa ---
@@ -73,49 +401,16 @@ class LoRaHandler:
         self.cerrar()  # Por si hay algo anterior abierto
 
         for intento in range(1, max_intentos + 1):
-            print(f"\n[LoRa] Inicializando... (Intento {intento})")
+            log.info("Inicializando... (intento %d)", intento)
 
             try:
-                # Inicializar pines CS y RESET
-                self.cs = digitalio.DigitalInOut(self.pin_cs)
-                self.cs.direction = digitalio.Direction.OUTPUT
-
-                self.reset = digitalio.DigitalInOut(self.pin_reset)
-                self.reset.direction = digitalio.Direction.OUTPUT
-
-                # Resetear físicamente el módulo LoRa
-                self.reset.value = False
-                time.sleep(0.1)
-                self.reset.value = True
-                time.sleep(0.1)
-
-                # Inicializar SPI
-                self.spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
-
-                # Inicializar módulo RFM9x
-                self.rfm9x = adafruit_rfm9x.RFM9x(
-                    self.spi, self.cs, self.reset, self.frecuencia_mhz, baudrate=1000000)
-
-                # Configurar parámetros LoRa
-                self.rfm9x.spreading_factor = 7
-                self.rfm9x.signal_bandwidth = 125E3
-                self.rfm9x.coding_rate = 4
-                self.rfm9x.preamble_length = 8
-                self.rfm9x.enable_crc = True
-                self.rfm9x.tx_power = 14
-
-                # Configurar interrupción DIO0
-                self.dio0 = DigitalInputDevice(self.pin_dio, pull_up=False)
-                self.dio0.when_activated = self.rx_callback
-
-                # Comenzar a escuchar
-                self.rfm9x.listen()
-                print("[LoRa] Inicializado y escuchando.")
+                self.radio.iniciar(self.rx_callback)
+                log.info("Inicializado y escuchando")
                 self.lora_inicializado = True
                 return
 
             except Exception as e:
-                print(f"[ERROR LoRa Init - intento {intento}] {type(e).__name__}: {e}")
+                log.error("Error al inicializar (intento %d): %s: %s", intento, type(e).__name__, e)
 
                 # Limpiar recursos de este intento
                 self.cerrar()
@@ -126,23 +421,28 @@ class LoRaHandler:
         self.lora_inicializado = False
         raise RuntimeError(f"[LoRa] No se pudo inicializar tras {max_intentos} intentos.")
 
-    # --- Enviar mensajes por LoRa ---
-    def enviar_lora(self, mensaje, cabecera=False):
+    # --- Encolar mensajes para enviar por LoRa ---
+    def enviar_lora(self, mensaje, cabecera=False, clave=None, recibido=None):
+        """
+        Encola el mensaje en el planificador de transmisión; se envía con transmitir_pendientes().
+        Mensajes con la misma 'clave' aún no enviados se fusionan en uno. 'recibido' es el
+        instante de recepción de la trama que se responde (para la etapa 'total_ack').
+        """
         if not self.lora_inicializado:
-            print("[LoRa] No inicializado. No se puede enviar mensaje.")
+            log.warning("No inicializado, no se puede enviar mensaje")
             return False
 
-        try:
-            mensaje_completo = f"{self.id_red}:{mensaje}" if cabecera else mensaje
-
-            print("\n[LoRa] Enviando paquete...")
-            print(f"Contenido: {mensaje_completo}")
+        mensaje_completo = f"{self.id_red}:{mensaje}" if cabecera else mensaje
+        log.debug("Encolado para envío: %s", mensaje_completo)
+        self.planificador_tx.encolar(bytes(mensaje_completo, "utf-8"), clave, recibido)
+        return True
 
-            self.rfm9x.send(bytes(mensaje_completo, "utf-8"), keep_listening=True)
-
-            print("[LoRa] Mensaje enviado correctamente.")
-            return True
-
-        except Exception as e:
-            print(f"[ERROR LoRa Envío] {type(e).__name__}: {e}")
-            return False
+    # --- Transmitir los mensajes encolados ---
+    def transmitir_pendientes(self):
+        """
+        Retorna el instante (time.monotonic) del próximo intento si quedaron mensajes
+        esperando presupuesto de ciclo de trabajo, o None.
+        """
+        if not self.lora_inicializado:
+            return None
+        return self.planificador_tx.transmitir_pendientes()
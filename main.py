@@ -1,50 +1,63 @@
 import time
-import subprocess
 import sys
+import argparse
+import threading
 from lora_LIB import LoRaHandler
-from tramas_LIB import TramaHandler
+from tramas_LIB import TramaHandler, lecturas_sensor
 from mqtt_LIB import MQTTClientHandler
-from archivos_LIB import FileHandler
+from archivos_LIB import FileHandler, BandejaSalida
+from red_LIB import MonitorConectividad
+from metricas_LIB import MetricasLatencia
+from despacho_LIB import ColaDespacho, EventoTrama, PRIORIDAD_TELEMETRIA
+from telemetria_LIB import AgregadorTelemetria
+from dispositivos_LIB import RegistroDispositivos
+from logs_LIB import obtener_logger, configurar_logs, detener_logs
+from distribuido_LIB import ReenviadorNodo, ProcesadorCentral
+from captura_LIB import CapturaTramas, RadioReproduccion
+from exportador_LIB import ServidorMetricas, memoria_residente
+
+log = obtener_logger("main")
 
 # Variables globales
 direccion_topicos = {"empresa": None, "area": None}
 topic_base = None
 mac_local = None
-internet_ok = False
-contador_publicaciones = 0
+en_vuelo = set()  # ids de la bandeja entregados al cliente MQTT y aún sin confirmar
+cola_despacho = ColaDespacho()
+agregador = AgregadorTelemetria()
+registro_dispositivos = RegistroDispositivos()
 
-def estado_wifi():
-    global internet_ok
+# Modo dividido (opcional): nodo de radio que reenvía tramas, o procesador central de varios nodos
+reenviador = None
+procesador = None
 
-    try:
-        ping_resultado = subprocess.run(
-            ["ping", "-c", "1", "-W", "2", "8.8.8.8"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-        
-        if ping_resultado.returncode == 0:
-            # Hay internet, señalamos bandera OK y salimos
-            internet_ok = True
-            return
-        
-        else:
-            print("Sin acceso a internet...")
-            internet_ok = False
-        
-    except Exception as e:
-        internet_ok = False
-        error_msg = f"Error al verificar o reiniciar WiFi: {type(e).__name__} - {e}"
-        archivo.log_errores(error_msg)
+# Despierta al lazo principal: tramas recibidas, mensajes MQTT y cambios de conexión
+despertar = threading.Event()
+
+publicadas = 0  # publicaciones confirmadas por el broker
+
+# Endpoint HTTP de métricas (opcional, --metricas)
+servidor_metricas = None
+
+# Latencias por etapa del llamado, desde la interrupción DIO0 hasta la confirmación MQTT
+metricas = MetricasLatencia()
+instantes_rx = {}  # id de evento en bandeja -> instante de recepción (solo eventos de esta ejecución)
+MAX_INSTANTES_RX = 10000
+
+def actualizar_topic_base(configuracion):
+    # El tópico de publicación se conoce desde la configuración, aunque MQTT aún no esté conectado
+    global topic_base
+    if 'empresa' in configuracion and 'area' in configuracion:
+        topic_base = f"{configuracion['empresa']}/{configuracion['area']}"
 
-def sub_manager():
+def sub_manager(configuracion=None):
     global direccion_topicos, topic_base
-    datos = archivo.leer_archivo()
+    datos = configuracion if configuracion is not None else archivo.obtener_configuracion()
 
     try:
-        empresa_actual = datos.loc[datos['clave'] == 'empresa', 'valor'].values[0]
-        area_actual = datos.loc[datos['clave'] == 'area', 'valor'].values[0]
-    except IndexError as e:
+        empresa_actual = datos['empresa']
+        area_actual = datos['area']
+    except KeyError as e:
         error_msg = f"No se encontró 'empresa' o 'area' en el archivo de configuración: {type(e).__name__} - {e}"
         archivo.log_errores(error_msg)
         return
@@ -56,120 +69,462 @@ def sub_manager():
         direccion_topicos["empresa"] = empresa_actual
         direccion_topicos["area"] = area_actual
         topic_base = f"{empresa_actual}/{area_actual}"
-        print(f"Suscrito inicialmente a: {topic_sub_nuevo}")
+        log.info("Suscrito inicialmente a: %s", topic_sub_nuevo)
 
     elif (empresa_actual != direccion_topicos["empresa"]) or (area_actual != direccion_topicos["area"]):
         topic_sub_anterior = f"{direccion_topicos['empresa']}/{direccion_topicos['area']}/{mac_local}/down"
         mqtt.unsubscribe(topic_sub_anterior)
         mqtt.subscribe(topic_sub_nuevo)
-        print(f"Suscrito a nuevo topic: {topic_sub_nuevo}")
+        log.info("Suscrito a nuevo topic: %s", topic_sub_nuevo)
 
         direccion_topicos["empresa"] = empresa_actual
         direccion_topicos["area"] = area_actual
         topic_base = f"{empresa_actual}/{area_actual}"
 
     else:
-        print(f"Sin cambios en empresa/area")
+        log.debug("Sin cambios en empresa/area")
 
-if __name__ == "__main__":
-    print("iniciando llamado de enfermeria...")
+def clasificar_trama(recibida):
+    """
+    Procesa una trama recibida y la encola por prioridad. Las tramas inválidas se descartan.
+    """
+    metricas.registrar_desde("espera_rx", recibida.timestamp)
+    json_final = trama.procesar(recibida.payload)
+
+    if json_final is None:
+        return
+
+    registro_dispositivos.actualizar(trama.mac_remitente, recibida.rssi, trama.bateria, trama.codigo)
+    cola_despacho.agregar(EventoTrama(
+        recibida, json_final, trama.llamado_text, trama.mac_remitente, trama.codigo, trama.bateria, trama.duplicado, None))
+
+def despachar_tramas():
+    """
+    Atiende los eventos por prioridad. Antes de cada uno se incorporan las tramas
+    recién llegadas, así una alarma de incendio se adelanta a la telemetría en espera.
+    El ACK de cada evento se transmite en cuanto se atiende: bajo carga sostenida la
+    cola de despacho no llega a vaciarse y esperar al final del lote los dejaría sin salir.
+    Retorna el instante del próximo intento de transmisión si quedaron ACK sin presupuesto.
+    """
+    while True:
+        for recibida in lora.extraer_pendientes():
+            clasificar_trama(recibida)
+        evento = cola_despacho.extraer()
+        if evento is None:
+            return lora.transmitir_pendientes()
+        atender_evento(evento)
+        lora.transmitir_pendientes()
+
+def atender_evento(evento):
+    if evento.llamado == "sincro":
+        respuesta_codificada = trama.codificar(f"F5,{mac_local}")
+        lora.enviar_lora(respuesta_codificada, clave=("F5", evento.mac_remitente))
+        return
+
+    # Las etapas 'ack' y 'total_ack' se registran al transmitir (lora_LIB.PlanificadorTX)
+    respuesta_codificada = trama.codificar(evento.mac_remitente)
+    lora.enviar_lora(respuesta_codificada, clave=("ACK", evento.mac_remitente), recibido=evento.recibida.timestamp)
+
+    if evento.duplicado:
+        return
+
+    # Nodo de radio: la trama ya tiene ACK; el procesador central la procesa y publica
+    if reenviador is not None:
+        reenviador.enviar(evento.recibida)
+        return
+
+    # La telemetría se acumula por ventana salvo que cruce Lmin/Lmax; el resto pasa directo
+    if evento.codigo in agregador.codigos:
+        lecturas = lecturas_sensor(evento.bateria)
+        if agregador.agregar(evento.codigo, evento.mac_remitente, evento.payload, lecturas) is None:
+            return
+
+    # El evento se guarda primero en la bandeja de salida y se publica desde ahí por prioridad
+    topic_publish = f"{topic_base}/{evento.mac_remitente}/up"
+    id_evento = bandeja.agregar(topic_publish, evento.payload, evento.prioridad)
+    if len(instantes_rx) < MAX_INSTANTES_RX:
+        instantes_rx[id_evento] = evento.recibida.timestamp
+    if not reenviar_bandeja():
+        log.debug("Sin conexión, evento guardado en bandeja de salida (%d pendientes)", bandeja.profundidad())
+
+def reenviar_bandeja(lote=10):
+    """
+    Entrega hasta 'lote' eventos pendientes de la bandeja de salida al cliente MQTT,
+    por prioridad y sin esperar confirmación; cada evento se borra de la bandeja cuando
+    llega su on_publish. Se detiene si la ventana de publicaciones en vuelo está llena.
+    Retorna False si no hay condiciones para publicar.
+    """
+    # Publicar solo si internet está OK, MQTT está conectado y no hay error_flag
+    if not (monitor.internet_ok and mqtt.is_connected and not mqtt.error_flag):
+        return False
+
+    for id_evento, topic_publish, payload in bandeja.pendientes(lote, excluir=list(en_vuelo)):
+        futuro = mqtt.publicar_async(topic_publish, payload)
+        if futuro is None:
+            break
+        en_vuelo.add(id_evento)
+        enviado = time.monotonic()
+        futuro.add_done_callback(
+            lambda f, id_evento=id_evento, topic_publish=topic_publish, enviado=enviado:
+                confirmar_publicacion(f, id_evento, topic_publish, enviado))
+
+    return True
+
+def publicar_telemetria_agregada(forzar=False):
+    for mac, payload in agregador.vencidos(forzar=forzar):
+        bandeja.agregar(f"{topic_base}/{mac}/up", payload, PRIORIDAD_TELEMETRIA)
+    reenviar_bandeja()
+
+def publicar_estado_dispositivos(completo=False):
+    """
+    Publica en '{topic_base}/{mac_local}/dispositivos' el estado de los dispositivos vistos:
+    todos si completo=True (y purga los vencidos), o solo los modificados desde la última vez.
+    """
+    if topic_base is None:
+        return
+    if completo:
+        registro_dispositivos.purgar()
+        payload = registro_dispositivos.instantanea()
+    else:
+        payload = registro_dispositivos.delta()
+    if payload is None or not payload["dispositivos"]:
+        return
+    bandeja.agregar(f"{topic_base}/{mac_local}/dispositivos", payload, PRIORIDAD_TELEMETRIA)
+    reenviar_bandeja()
+
+def confirmar_publicacion(futuro, id_evento, topic_publish, enviado):
+    global publicadas
+
+    if not futuro.result():
+        # El evento sigue en la bandeja y se vuelve a enviar en el próximo reenvío
+        en_vuelo.discard(id_evento)
+        return
+
+    bandeja.confirmar(id_evento)
+    en_vuelo.discard(id_evento)
+    publicadas += 1
+    metricas.registrar_desde("publicacion", enviado)
+    instante_rx = instantes_rx.pop(id_evento, None)
+    if instante_rx is not None:
+        metricas.registrar_desde("total", instante_rx)
+    log.debug("Publicado en: %s", topic_publish)
+    if procesador is not None:
+        despertar.set()  # el central publica en cuanto se libera la ventana en vuelo
+
+def reproduccion_terminada(radio):
+    """
+    True cuando la captura se reprodujo completa y todo lo recibido ya se procesó y publicó.
+    """
+    return (radio.terminado.is_set() and not lora.paquete_recibido and not len(cola_despacho)
+            and not bandeja.profundidad() and not mqtt.en_vuelo())
+
+def contrapresion_reproduccion():
+    # A velocidad máxima la captura espera mientras el buffer de radio o la cola de despacho
+    # estén a medio llenar: se mide el procesamiento y no los descartes de la propia reproducción
+    return (len(lora.buffer_rx) >= lora.buffer_rx.capacidad // 2
+            or len(cola_despacho) >= cola_despacho.capacidad // 2)
+
+def reportar_reproduccion(radio):
+    # Hasta que se publicó lo último (no solo hasta que la radio entregó el último paquete)
+    duracion = time.monotonic() - radio.inicio
+    log.info("Reproducción de %s a velocidad %s: %d paquetes en %.2f s (%.0f paquetes/s)",
+             radio.ruta, radio.velocidad or "máxima", radio.reproducidas, duracion, radio.reproducidas / duracion)
+    log.info("Descartadas por buffer lleno: %d, por cola de despacho llena: %d, inválidas: %d, de otro gateway: %d, publicadas: %d",
+             lora.buffer_rx.descartadas, cola_despacho.total_descartados(), trama.invalidas, trama.ajenas, publicadas)
+    if metricas.etapas:
+        log.info("Latencias por etapa\n%s", metricas.texto_resumen())
+
+def manejadores_trama():
+    # En modo central cada nodo tiene su propio TramaHandler (con su caché de duplicados)
+    if procesador is None:
+        return [trama]
+    return [trama] + [contexto.trama for contexto in list(procesador.nodos.values())]
+
+def recolectar_metricas():
+    """
+    Contadores y estados del gateway para el endpoint de métricas, como (nombre, tipo, ayuda, valor).
+    Solo lee atributos: se llama desde el hilo del servidor HTTP en cada consulta.
+    """
+    if lora:
+        recibidas = lora.buffer_rx.total_recibidas
+        descartadas = lora.buffer_rx.descartadas + cola_despacho.total_descartados()
+    elif procesador:
+        recibidas, descartadas = procesador.recibidas, procesador.descartadas
+    else:
+        recibidas = descartadas = None
+    tramas = manejadores_trama()
+
+    return [
+        ("tramas_recibidas_total", "counter", "Tramas recibidas con el ID de red (o desde los nodos en modo central)", recibidas),
+        ("tramas_descartadas_total", "counter", "Tramas descartadas por buffer, cola de despacho o cola del central llenos", descartadas),
+        ("tramas_invalidas_total", "counter", "Tramas corruptas o con formato inválido", sum(t.invalidas for t in tramas)),
+        ("tramas_ajenas_total", "counter", "Tramas dirigidas a otro gateway", sum(t.ajenas for t in tramas)),
+        ("duplicados_aciertos_total", "counter", "Retransmisiones detectadas por la caché de duplicados (solo ACK)",
+         sum(t.cache_duplicados.aciertos for t in tramas)),
+        ("duplicados_fallos_total", "counter", "Tramas válidas que no estaban en la caché de duplicados",
+         sum(t.cache_duplicados.fallos for t in tramas)),
+        ("buffer_rx_maximo_ocupado", "gauge", "Máximo de tramas esperando a la vez en el buffer de recepción",
+         lora.buffer_rx.maximo_ocupado if lora else None),
+        ("buffer_rx_capacidad", "gauge", "Capacidad del buffer de recepción", lora.buffer_rx.capacidad if lora else None),
+        ("radio_enviadas_total", "counter", "Tramas transmitidas por la radio (ACK y respuestas de sincronización)",
+         lora.planificador_tx.enviadas if lora else None),
+        ("publicaciones_intentadas_total", "counter", "Publicaciones entregadas al cliente MQTT", mqtt.publicaciones_intentadas),
+        ("publicaciones_confirmadas_total", "counter", "Publicaciones confirmadas por el broker", mqtt.publicaciones_confirmadas),
+        ("publicaciones_vencidas_total", "counter", "Publicaciones sin confirmar dentro del timeout", mqtt.publicaciones_vencidas),
+        ("mqtt_reconexiones_total", "counter", "Reconexiones del supervisor MQTT", mqtt.reconexiones),
+        ("mqtt_conectado", "gauge", "1 si el cliente MQTT está conectado", mqtt.is_connected),
+        ("internet_ok", "gauge", "1 si la última verificación de internet fue exitosa", monitor.internet_ok),
+        ("configuracion_recargas_total", "counter", "Cambios de configuración aplicados después del arranque", archivo.recargas),
+        ("bandeja_pendientes", "gauge", "Eventos en la bandeja de salida sin confirmar", bandeja.profundidad()),
+        ("memoria_residente_bytes", "gauge", "Memoria residente (RSS) del proceso", memoria_residente())
+    ]
+
+def leer_argumentos():
+    parser = argparse.ArgumentParser(description="Gateway LoRa/MQTT de llamado de enfermería")
+    parser.add_argument("--simular", action="store_true",
+                        help="usar radio simulada y broker en proceso (pruebas de carga sin hardware)")
+    parser.add_argument("--tasa", type=float, default=100.0, help="tramas/s generadas por la radio simulada")
+    parser.add_argument("--dispositivos", type=int, default=200, help="cantidad de botones simulados")
+    parser.add_argument("--broker", default=None, help="servidor MQTT alternativo (p. ej. localhost)")
+    parser.add_argument("--ciclo-trabajo", type=float, default=None,
+                        help="fracción máxima de tiempo en el aire de la radio (0.1 por defecto, sin límite al simular)")
+    parser.add_argument("--debug", action="store_true",
+                        help="registrar cada trama, ACK y publicación (por defecto solo arranque, reportes y errores)")
+    parser.add_argument("--nodo-de", metavar="HOST:PUERTO", default=None,
+                        help="modo nodo de radio: solo ACK y reenvío de tramas crudas al procesador central")
+    parser.add_argument("--central", metavar="PUERTO", type=int, default=None,
+                        help="modo procesador central: recibe tramas de los nodos y publica por una sola conexión MQTT")
+    parser.add_argument("--hilos", type=int, default=4, help="hilos de procesamiento del modo central")
+    parser.add_argument("--capturar", metavar="RUTA", default=None,
+                        help="guardar cada paquete recibido (crudo, con RSSI e instante) en un archivo de captura")
+    parser.add_argument("--reproducir", metavar="RUTA", default=None,
+                        help="reproducir una captura en lugar de la radio (con broker en proceso salvo --broker) y reportar")
+    parser.add_argument("--velocidad", type=float, default=1.0,
+                        help="velocidad de reproducción: 1 = tiempo real, N = N veces más rápido, 0 = máxima")
+    parser.add_argument("--metricas", metavar="[HOST:]PUERTO", default=None,
+                        help="servir métricas en http://HOST:PUERTO/metrics (Prometheus) y /metrics.json (127.0.0.1 por defecto)")
+    parser.add_argument("--directorio", default=None, help="directorio de configuración y bandeja de salida")
+    return parser.parse_args()
 
-    lora = LoRaHandler()
-    archivo = FileHandler()
-    while not internet_ok:
-        estado_wifi()
-        time.sleep(10)
-    trama = TramaHandler()
-    mqtt = MQTTClientHandler()
+if __name__ == "__main__":
+    argumentos = leer_argumentos()
+    configurar_logs(debug=argumentos.debug)
+    log.info("Iniciando llamado de enfermería...")
+
+    archivo = FileHandler(directory=argumentos.directorio)
+    bandeja = BandejaSalida(directory=archivo.directory)
+    trama = TramaHandler(archivo, metricas=metricas)
+
+    lora = None  # el procesador central no tiene radio
+    opciones_mqtt = {"server": argumentos.broker} if argumentos.broker else {}
+    if argumentos.simular or argumentos.reproducir:
+        from simulacion_LIB import RadioSimulada, ClienteMQTTSimulado
+
+        trama.mac_local = trama.mac_local or "AA:BB:CC:DD:EE:FF"
+        if argumentos.reproducir:
+            radio = RadioReproduccion(argumentos.reproducir, velocidad=argumentos.velocidad,
+                                      contrapresion=contrapresion_reproduccion)
+            # Las tramas capturadas van dirigidas al gateway que las capturó, no a este equipo
+            trama.mac_local = radio.mac_local or trama.mac_local
+            lora = LoRaHandler(radio=radio, ciclo_trabajo=argumentos.ciclo_trabajo, metricas=metricas)
+        elif argumentos.central is None:
+            lora = LoRaHandler(radio=RadioSimulada(trama.mac_local, tasa=argumentos.tasa, dispositivos=argumentos.dispositivos),
+                               ciclo_trabajo=argumentos.ciclo_trabajo, metricas=metricas)
+        if not argumentos.broker:
+            opciones_mqtt["cliente"] = ClienteMQTTSimulado()
+        monitor = MonitorConectividad(verificador=lambda: True)
+    else:
+        if argumentos.central is None:
+            lora = LoRaHandler(ciclo_trabajo=argumentos.ciclo_trabajo if argumentos.ciclo_trabajo is not None else 0.1,
+                               metricas=metricas)
+        monitor = MonitorConectividad()
+
+    mqtt = MQTTClientHandler(**opciones_mqtt)
+    mqtt.agregar_observador_conexion(monitor.notificar_mqtt)
+    mqtt.aviso = despertar
+    if lora:
+        lora.aviso = despertar
+        if argumentos.capturar:
+            lora.captura = CapturaTramas(argumentos.capturar, trama.mac_local)
+
+    if argumentos.nodo_de:
+        host, _, puerto = argumentos.nodo_de.rpartition(":")
+        reenviador = ReenviadorNodo(host, int(puerto), trama.mac_local)
+    if argumentos.central is not None:
+        procesador = ProcesadorCentral(argumentos.central, archivo.directory, bandeja, mqtt,
+                                       hilos=argumentos.hilos, aviso=despertar, metricas=metricas, archivo_base=archivo)
+    if argumentos.metricas:
+        host, _, puerto = argumentos.metricas.rpartition(":")
+        servidor_metricas = ServidorMetricas(int(puerto), recolectar_metricas, host=host or "127.0.0.1")
 
     try:
+        # La radio se inicia primero: los ACK locales no dependen de internet
         mac_local = trama.mac_local
-        lora.iniciar_lora()
-        mqtt.connect()
-        sub_manager()
+        archivo.suscribir(actualizar_topic_base)
+        if lora:
+            lora.iniciar_lora()
+
+        if reenviador:
+            # Nodo de radio: sin MQTT ni monitor de internet, solo el enlace con el central
+            reenviador.iniciar()
+        else:
+            # Internet y MQTT se resuelven en segundo plano; los eventos esperan en la bandeja de salida.
+            # El supervisor reconecta con backoff y vuelve a suscribir sin frenar la radio ni los ACK.
+            monitor.iniciar()
+            archivo.suscribir(sub_manager)  # se suscribe ahora y ante cada cambio de configuración
+            mqtt.iniciar_supervisor(puede_conectar=lambda: monitor.internet_ok)
+        if procesador:
+            procesador.iniciar()
+        if servidor_metricas:
+            servidor_metricas.iniciar()
 
         tiempo_ultima_inicializacion = time.monotonic()
         intervalo_reinicializacion = 300.0  # 5 minutos
+        tiempo_ultima_verificacion_config = time.monotonic()
+        intervalo_verificacion_config = 5.0
+        tiempo_ultimo_reenvio = time.monotonic()
+        intervalo_reenvio = 0.5  # lotes de 10 eventos cada 0.5 s como máximo al vaciar atrasos
+        tiempo_ultimo_reporte_metricas = time.monotonic()
+        intervalo_reporte_metricas = 60.0
+        proximo_tx = None  # ACK en espera de presupuesto de ciclo de trabajo
+        tiempo_ultimo_estado = time.monotonic()
+        intervalo_estado = 60.0  # delta de dispositivos modificados
+        tiempo_ultimo_estado_completo = time.monotonic()
+        intervalo_estado_completo = 900.0  # estado completo cada 15 minutos
+        tiempo_ultima_compactacion = time.monotonic()
+        intervalo_compactacion = 60.0  # bandeja de salida: páginas de eventos confirmados y WAL
+        tiempo_ultima_revision_nodos = time.monotonic()
+        intervalo_revision_nodos = 1.0  # modo central: ventanas de telemetría vencidas de los nodos
 
         while True:
+            # Bloquear hasta un evento o hasta la próxima tarea periódica (sin sondeo)
+            vencimientos = [
+                tiempo_ultima_verificacion_config + intervalo_verificacion_config,
+                tiempo_ultimo_reporte_metricas + intervalo_reporte_metricas,
+                tiempo_ultimo_estado + intervalo_estado
+            ]
+            if bandeja.profundidad():
+                vencimientos.append(tiempo_ultimo_reenvio + intervalo_reenvio)
+            if proximo_tx is not None:
+                vencimientos.append(proximo_tx)
+            if agregador.proximo_vencimiento() is not None:
+                vencimientos.append(agregador.proximo_vencimiento())
+            if procesador:
+                vencimientos.append(tiempo_ultima_revision_nodos + intervalo_revision_nodos)
+            despertar.wait(max(0.0, min(vencimientos) - time.monotonic()))
+            despertar.clear()
+
             tiempo_actual = time.monotonic()
 
-            # Verificar si hubo error en MQTT o si no esta conectado, y reconectar si es necesario
-            if (mqtt.error_flag or (not mqtt.is_connected)):
-                estado_wifi()
-                if internet_ok:
-                    print("Reconectando a MQTT por error o desconexión...")
-                    try:
-                        mqtt.disconnect()
-                    except Exception as e:
-                        error_msg = f"Error al desconectar MQTT previo: {type(e).__name__} - {e}"
-                        archivo.log_errores(error_msg)
-                    try:
-                        mqtt.connect()
-                        sub_manager()  # volver a suscribirse al último topic guardado
-                        mqtt.error_flag = False
-                        print("Reconexion MQTT exitosa.")
-                    except Exception as e:
-                        error_msg = f"Error al reconectar MQTT: {type(e).__name__} - {e}"
-                        archivo.log_errores(error_msg)
-                        print("Esperando 10 segundos antes de reintentar conexión MQTT...")
-                        time.sleep(10)
+            # Procesar todas las tramas acumuladas desde la última vuelta, por prioridad
+            if lora:
+                proximo_tx = despachar_tramas()
+            elif procesador and bandeja.profundidad():
+                reenviar_bandeja()  # los hilos del central solo encolan en la bandeja
+
+            if argumentos.reproducir and reproduccion_terminada(lora.radio):
+                reportar_reproduccion(lora.radio)
+                break
+
+            # Publicar las ventanas de telemetría vencidas
+            vencimiento_telemetria = agregador.proximo_vencimiento()
+            if vencimiento_telemetria is not None and vencimiento_telemetria <= tiempo_actual:
+                publicar_telemetria_agregada()
+
+            # Estado de los dispositivos: delta periódico y completo cada tanto
+            if tiempo_actual - tiempo_ultimo_estado >= intervalo_estado and reenviador is None:
+                completo = tiempo_actual - tiempo_ultimo_estado_completo >= intervalo_estado_completo
+                if procesador:
+                    procesador.revisar(estado=True, completo=completo)  # cada nodo publica los suyos
                 else:
-                    print("No hay internet, no se intenta reconectar a MQTT.")
-            
-            if lora.paquete_recibido:
-                mensaje = lora.mensaje_recibido
-                json_final = trama.procesar(mensaje)
-
-                if json_final is not None:
-                    if trama.llamado_text == "sincro":
-                        respuesta_codificada = trama.codificar(f"F5,{mac_local}")
-                        lora.enviar_lora(respuesta_codificada)
-                    else:
-                        respuesta_codificada = trama.codificar(trama.mac_remitente)
-                        lora.enviar_lora(respuesta_codificada)
-                        
-                        # Publicar solo si internet está OK, MQTT está conectado y no hay error_flag
-                        estado_wifi()
-                        if internet_ok and mqtt.is_connected and not mqtt.error_flag:
-                            topic_publish = f"{topic_base}/{trama.mac_remitente}/up"
-                            try:
-                                mqtt.publish(topic_publish, json_final)
-                                print(f"Publicado en: {topic_publish}")
-
-                                contador_publicaciones += 1
-
-                                if contador_publicaciones >= 10:
-                                    subprocess.run(["clear"])
-                                    contador_publicaciones = 0  # reinicio contador
-                            except Exception as e:
-                                error_msg = f"Error al publicar MQTT: {type(e).__name__} - {e}"
-                                archivo.log_errores(error_msg)
-                        else:
-                            print("No hay conexión a internet, MQTT desconectado o en estado de error, no se publica")
-
-                lora.paquete_recibido = False
-                lora.mensaje_recibido = ""
+                    publicar_estado_dispositivos(completo)
+                if completo:
+                    tiempo_ultimo_estado_completo = tiempo_actual
+                tiempo_ultimo_estado = tiempo_actual
+
+            # Modo central: la telemetría de cada nodo se agrega y se publica en el hilo del nodo
+            if procesador and tiempo_actual - tiempo_ultima_revision_nodos >= intervalo_revision_nodos:
+                procesador.revisar()
+                tiempo_ultima_revision_nodos = tiempo_actual
+
+            # Vaciar atrasos de la bandeja de salida a ritmo controlado
+            if bandeja.profundidad() and tiempo_actual - tiempo_ultimo_reenvio >= intervalo_reenvio:
+                if reenviar_bandeja():
+                    estado = bandeja.estadisticas()
+                    log.debug("Bandeja de salida: %d pendientes, %.1f eventos/s", estado['pendientes'], estado['tasa_reenvio'])
+                tiempo_ultimo_reenvio = tiempo_actual
 
             if mqtt.actualizacion:
-                archivo.actualizar_archivo(mqtt.mensaje_recibido)
-                sub_manager()
+                # En modo central la bajada puede ser la configuración de un nodo
+                if procesador is None or not procesador.aplicar_bajada(mqtt.topico_recibido, mqtt.mensaje_recibido):
+                    archivo.actualizar_archivo(mqtt.mensaje_recibido)  # notifica a sub_manager y trama
                 mqtt.actualizacion = False
 
-            time.sleep(0.01)
+            # Reporte periódico de latencias por etapa
+            if tiempo_actual - tiempo_ultimo_reporte_metricas >= intervalo_reporte_metricas:
+                if metricas.etapas:
+                    reporte = metricas.texto_resumen()
+                    log.info("Latencias por etapa\n%s", reporte)
+                    archivo.log_eventos(metricas.resumen())
+                if lora:
+                    rx = lora.buffer_rx.estadisticas()
+                    log.info("Radio RX: %d recibidas, %d descartadas, máximo ocupado %d de %d",
+                             rx['total_recibidas'], rx['descartadas'], rx['maximo_ocupado'], rx['capacidad'])
+                    tx = lora.planificador_tx.estadisticas()
+                    log.info("Radio TX: %d enviadas, %d fusionadas, %d vencidas, tiempo en el aire %.1f s, utilización %.2f%%",
+                             tx['enviadas'], tx['fusionadas'], tx['vencidas'], tx['aire_total_s'], tx['utilizacion'] * 100)
+                cache = [t.cache_duplicados.estadisticas() for t in manejadores_trama()]
+                log.info("Caché de duplicados: %d aciertos, %d fallos, %d entradas",
+                         sum(c['aciertos'] for c in cache), sum(c['fallos'] for c in cache), sum(c['entradas'] for c in cache))
+                if reenviador:
+                    log.info("Reenvío al central: %s", reenviador.estadisticas())
+                if procesador:
+                    log.info("Procesador central: %s", procesador.estadisticas())
+                for prioridad, datos in cola_despacho.estadisticas().items():
+                    espera = datos["espera"] or {}
+                    log.info("Prioridad %s: %d en cola, %d descartados, espera p95 %.2f ms, max %.2f ms",
+                             prioridad, datos['profundidad'], datos['descartados'],
+                             espera.get('p95_ms', 0.0), espera.get('max_ms', 0.0))
+                tiempo_ultimo_reporte_metricas = tiempo_actual
+
+            # Compactar la bandeja aquí y no al confirmar, que corre en el hilo de red de MQTT
+            if tiempo_actual - tiempo_ultima_compactacion >= intervalo_compactacion:
+                bandeja.compactar()
+                tiempo_ultima_compactacion = tiempo_actual
+
+            # Detectar ediciones externas del archivo de configuración
+            if tiempo_actual - tiempo_ultima_verificacion_config >= intervalo_verificacion_config:
+                archivo.verificar_cambios()
+                tiempo_ultima_verificacion_config = tiempo_actual
 
     except KeyboardInterrupt:
-        print("\nInterrupcion por teclado. Saliendo...\n")
+        log.info("Interrupción por teclado. Saliendo...")
 
     except Exception as e:
-        error_msg = f"\nError: {e}\n"
-        print(error_msg)
-        archivo.log_errores(error_msg)
+        log.exception("Error en el lazo principal")
+        archivo.log_errores(f"Error: {e}")
 
     finally:
-        print("Liberando recursos...\n")
-        lora.cerrar()
+        log.info("Liberando recursos...")
+        try:
+            publicar_telemetria_agregada(forzar=True)  # guardar en la bandeja las ventanas abiertas
+        except Exception as e:
+            log.error("Error guardando telemetría agregada: %s - %s", type(e).__name__, e)
+        if lora:
+            lora.cerrar()
+            if lora.captura:
+                lora.captura.cerrar()
+        if reenviador:
+            reenviador.cerrar()
+        if procesador:
+            procesador.detener()
+        if servidor_metricas:
+            servidor_metricas.detener()
         mqtt.disconnect()
+        monitor.detener()
+        archivo.cerrar()
+        bandeja.cerrar()
+        detener_logs()
         sys.exit(0)
 
 
@@ -0,0 +1,106 @@
+import math
+import time
+import threading
+from bisect import bisect_left
+
+
+# Límites superiores de los buckets en segundos: escala geométrica de 10 µs a ~100 s
+FACTOR_BUCKET = 1.15
+LIMITES_BUCKETS = [1e-5 * FACTOR_BUCKET ** i for i in range(int(math.log(1e7) / math.log(FACTOR_BUCKET)) + 2)]
+
+
+class HistogramaLatencia:
+    """
+    Histograma de latencias con buckets fijos: registrar() es O(log buckets) y no guarda
+    muestras, así la memoria no crece. Los percentiles se informan con el límite superior
+    del bucket (error máximo ~15 %); el máximo y el promedio son exactos.
+    """
+    def __init__(self):
+        self._conteos = [0] * (len(LIMITES_BUCKETS) + 1)
+        self._lock = threading.Lock()
+        self.cantidad = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+
+    def registrar(self, segundos: float):
+        indice = bisect_left(LIMITES_BUCKETS, segundos)
+        with self._lock:
+            self._conteos[indice] += 1
+            self.cantidad += 1
+            self.suma += segundos
+            if segundos > self.maximo:
+                self.maximo = segundos
+
+    def percentil(self, p: float) -> float:
+        with self._lock:
+            if not self.cantidad:
+                return 0.0
+            objetivo = math.ceil(self.cantidad * p / 100.0)
+            acumulado = 0
+            for indice, conteo in enumerate(self._conteos):
+                acumulado += conteo
+                if acumulado >= objetivo:
+                    if indice < len(LIMITES_BUCKETS):
+                        return min(LIMITES_BUCKETS[indice], self.maximo)
+                    return self.maximo
+            return self.maximo
+
+    def resumen(self):
+        return {
+            "cantidad": self.cantidad,
+            "promedio_ms": (self.suma / self.cantidad * 1000.0) if self.cantidad else 0.0,
+            "p50_ms": self.percentil(50) * 1000.0,
+            "p95_ms": self.percentil(95) * 1000.0,
+            "p99_ms": self.percentil(99) * 1000.0,
+            "max_ms": self.maximo * 1000.0
+        }
+
+    def reiniciar(self):
+        with self._lock:
+            self._conteos = [0] * (len(LIMITES_BUCKETS) + 1)
+            self.cantidad = 0
+            self.suma = 0.0
+            self.maximo = 0.0
+
+
+class MetricasLatencia:
+    """
+    Histogramas de latencia por etapa del llamado (espera_rx, decodificacion, json,
+    ack, publicacion y totales). Las etapas se crean al primer registro.
+    """
+    def __init__(self):
+        self.etapas = {}
+        self._lock = threading.Lock()
+        self.inicio = time.monotonic()
+
+    def registrar(self, etapa: str, segundos: float):
+        histograma = self.etapas.get(etapa)
+        if histograma is None:
+            with self._lock:
+                histograma = self.etapas.setdefault(etapa, HistogramaLatencia())
+        histograma.registrar(segundos)
+
+    def registrar_desde(self, etapa: str, inicio: float) -> float:
+        """
+        Registra el tiempo transcurrido desde 'inicio' (time.monotonic) y retorna el instante actual.
+        """
+        ahora = time.monotonic()
+        self.registrar(etapa, ahora - inicio)
+        return ahora
+
+    def resumen(self):
+        return {etapa: histograma.resumen() for etapa, histograma in list(self.etapas.items())}
+
+    def texto_resumen(self) -> str:
+        lineas = [f"{'etapa':<16}{'n':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for etapa, datos in self.resumen().items():
+            lineas.append(
+                f"{etapa:<16}{datos['cantidad']:>8}{datos['p50_ms']:>10.2f}{datos['p95_ms']:>10.2f}"
+                f"{datos['p99_ms']:>10.2f}{datos['max_ms']:>10.2f}"
+            )
+        return "\n".join(lineas)
+
+    def reiniciar(self):
+        for histograma in list(self.etapas.values()):
+            histograma.reiniciar()
+        self.inicio = time.monotonic()
@@ -3,8 +3,12 @@ import threading
 import string
 import random
 import json
+from concurrent.futures import Future
 import paho.mqtt.client as mqtt
 from paho.mqtt.client import CallbackAPIVersion
+from logs_LIB import obtener_logger
+
+log = obtener_logger("mqtt")
 
 class MQTTClientHandler:
     def __init__(
@@ -13,7 +17,9 @@ class MQTTClientHandler:
         port: int = 1883,
         username: str = "device1.helpmedica",
         password: str = "device1.helpmedica",
-        client_id=None
+        client_id=None,
+        ventana_vuelo: int = 20,
+        cliente=None
     ):
         self.server = server
         self.port = port
@@ -21,18 +27,16 @@ class MQTTClientHandler:
         self.password = password
         self.client_id = client_id if client_id else self.generate_client_id()
 
-        # Initialize client
-        self.client = mqtt.Client(
+        # Initialize client (se puede inyectar otro, p. ej. simulacion_LIB.ClienteMQTTSimulado)
+        self.client = cliente if cliente else mqtt.Client(
             client_id=self.client_id,
             callback_api_version=CallbackAPIVersion.VERSION2,
             clean_session=True,
-            reconnect_on_failure=True
+            reconnect_on_failure=False  # la reconexión la hace el supervisor (ver iniciar_supervisor)
         )
 
         if username and password:
             self.client.username_pw_set(username, password)
-        
-        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
 
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
@@ -43,123 +47,339 @@ class MQTTClientHandler:
         self.lock = threading.Lock()
         self.is_connected = False
         self.mensaje_recibido = None
+        self.topico_recibido = None
         self.actualizacion = False
 
+        # threading.Event opcional que se activa al llegar un mensaje o cambiar la conexión
+        self.aviso = None
+
         # Bandera de error
         self.error_flag = False
 
+        # Funciones llamadas con True/False en cada conexión o desconexión
+        self.observadores_conexion = []
+        self._conectado = threading.Event()
+
+        # Publicaciones en vuelo: mid -> (Future, instante de envío)
+        self.ventana_vuelo = ventana_vuelo
+        self._lock_vuelo = threading.RLock()
+        self._en_vuelo = {}
+        self._reservados = 0
+        self._publicados_tempranos = set()  # mids confirmados antes de registrarse
+        self._fallidos = set()  # mids vencidos o fallados: su ack tardío se descarta
+
+        # Estadísticas de publicación (enteros leídos por el endpoint de métricas)
+        self.publicaciones_intentadas = 0
+        self.publicaciones_confirmadas = 0
+        self.publicaciones_vencidas = 0   # sin on_publish dentro del timeout
+
+        # Tópicos suscritos (topic -> qos); se vuelven a suscribir en cada conexión
+        self.suscripciones = {}
+
+        # Supervisor de conexión: máquina de estados con backoff exponencial y jitter
+        self.estado = "detenido"
+        self.reconexiones = 0
+        self.espera_min = 1.0
+        self.espera_max = 60.0
+        self.timeout_conexion = 10.0
+        self.timeout_publicacion = 5.0  # para verificar_vencidos() desde el supervisor
+        self._puede_conectar = None
+        self._supervisor = None
+        self._detener_supervisor = threading.Event()
+        self._cambio_conexion = threading.Event()
+
     def generate_client_id(self, length=8):
         characters = string.ascii_letters + string.digits
         return "client_" + ''.join(random.choice(characters) for _ in range(length))
 
+    def agregar_observador_conexion(self, callback):
+        self.observadores_conexion.append(callback)
+
+    def _notificar_conexion(self, conectado: bool):
+        if self.aviso:
+            self.aviso.set()
+        for callback in self.observadores_conexion:
+            try:
+                callback(conectado)
+            except Exception as e:
+                log.error("Error en observador de conexion: %s", e)
+
     def on_connect(self, client, userdata, flags, reason_code, properties):
         try:
             if reason_code == 0:
-                print(f"Connected to MQTT Broker: {self.server}:{self.port}")
+                log.info("Conectado al broker %s:%s", self.server, self.port)
                 self.is_connected = True
+                self.error_flag = False
+                self._conectado.set()
+                self._resuscribir()
+                self._notificar_conexion(True)
             else:
-                print(f"Failed to connect, return code {reason_code}")
+                log.warning("No se pudo conectar, código %s", reason_code)
                 self.error_flag = True
         except Exception as e:
-            print(f"[MQTT] Error en on_connect: {e}")
+            log.error("Error en on_connect: %s", e)
             self.error_flag = True
 
     def on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
         try:
             self.is_connected = False
+            self._conectado.clear()
+            self._cambio_conexion.set()
+            self._fallar_en_vuelo()
+            self._notificar_conexion(False)
         except Exception as e:
-            print(f"[MQTT] Error en on_disconnect: {e}")
+            log.error("Error en on_disconnect: %s", e)
             self.error_flag = True
 
     def on_message(self, client, userdata, message):
         try:
-            payload_dict = json.loads(message.payload.decode())
-            print(f"[MQTT] Mensaje en topico {message.topic}\n")
-            print(json.dumps(payload_dict, indent=4))
+            payload_dict = json.loads(message.payload)
+            log.info("Mensaje en tópico %s: %r", message.topic, message.payload)
             self.mensaje_recibido = payload_dict
+            self.topico_recibido = message.topic
             self.actualizacion = True
+            if self.aviso:
+                self.aviso.set()
         except Exception as e:
-            print(f"[MQTT] Error al procesar mensaje: {e}")
+            log.error("Error al procesar mensaje: %s", e)
             self.error_flag = True
 
     def on_publish(self, client, userdata, mid, reason_code, properties):
         try:
-            pass
+            exito = not getattr(reason_code, "is_failure", False)
+            with self._lock_vuelo:
+                entrada = self._en_vuelo.pop(mid, None)
+                if entrada is not None:
+                    if exito:
+                        self.publicaciones_confirmadas += 1
+                elif mid in self._fallidos:
+                    # Ack tardío de una publicación ya fallada: paho reutiliza el mid
+                    # tras 65535 publicaciones y no debe confirmar a la siguiente
+                    self._fallidos.discard(mid)
+                elif self._reservados:
+                    # Llegó antes de que publicar_async() registrara el mid
+                    self._publicados_tempranos.add(mid)
+            if entrada:
+                entrada[0].set_result(exito)
         except Exception as e:
-            print(f"[MQTT] Error en on_publish: {e}")
+            log.error("Error en on_publish: %s", e)
             self.error_flag = True
 
     def on_subscribe(self, client, userdata, mid, reason_code_list, properties):
         try:
             pass
         except Exception as e:
-            print(f"[MQTT] Error en on_subscribe: {e}")
+            log.error("Error en on_subscribe: %s", e)
             self.error_flag = True
 
     def connect(self, keepalive=60):
         try:
-            print(f"Conectando a {self.server}:{self.port}")
+            log.info("Conectando a %s:%s", self.server, self.port)
             self.client.connect(self.server, self.port, keepalive)
             self.client.loop_start()
         except Exception as e:
-            print(f"Error al conectar: {e}")
+            log.warning("Error al conectar: %s", e)
             self.error_flag = True
 
+    def iniciar_supervisor(self, puede_conectar=None):
+        """
+        Conecta y mantiene la conexión desde un hilo en segundo plano. Ante un error o
+        una desconexión reintenta con backoff exponencial con jitter, sin bloquear al
+        llamador. 'puede_conectar' (opcional) retorna False mientras no haya internet.
+        """
+        if self._supervisor is not None:
+            return
+        self._puede_conectar = puede_conectar
+        self._detener_supervisor.clear()
+        self._supervisor = threading.Thread(target=self._supervisar, name="mqtt_supervisor", daemon=True)
+        self._supervisor.start()
+
+    def _supervisar(self):
+        intentos = 0
+        self.estado = "conectando"
+        while not self._detener_supervisor.is_set():
+            if self.estado == "conectado":
+                # error_flag (p. ej. publicaciones sin confirmar) también fuerza la reconexión
+                self._cambio_conexion.wait(1.0)
+                self._cambio_conexion.clear()
+                self.verificar_vencidos()
+                if not self.is_connected or self.error_flag:
+                    log.warning("Conexión perdida o con error, reconectando en segundo plano...")
+                    self._cerrar_cliente()
+                    self.reconexiones += 1
+                    self.estado = "esperando"
+                    self._detener_supervisor.wait(self._espera_backoff(0))
+
+            elif self.estado == "conectando":
+                if self._puede_conectar and not self._puede_conectar():
+                    self._detener_supervisor.wait(1.0)
+                    continue
+                self._cambio_conexion.clear()
+                self.connect()
+                if not self.error_flag and self._conectado.wait(self.timeout_conexion) and not self.error_flag:
+                    intentos = 0
+                    self.estado = "conectado"
+                else:
+                    self._cerrar_cliente()
+                    intentos += 1
+                    espera = self._espera_backoff(intentos)
+                    log.warning("No se pudo conectar, reintento %d en %.1f s", intentos, espera)
+                    self.estado = "esperando"
+                    self._detener_supervisor.wait(espera)
+
+            else:  # esperando
+                self.estado = "conectando"
+        self.estado = "detenido"
+
+    def _espera_backoff(self, intentos):
+        # Jitter "igual": mitad fija y mitad aleatoria, para no reconectar todos los gateways a la vez
+        tope = min(self.espera_max, self.espera_min * (2 ** intentos))
+        return tope / 2 + random.uniform(0, tope / 2)
+
+    def _cerrar_cliente(self):
+        try:
+            self.client.disconnect()
+            self.client.loop_stop()
+        except Exception as e:
+            log.warning("Error al cerrar la conexión previa: %s", e)
+        self.is_connected = False
+        self._conectado.clear()
+        self.error_flag = False
+
     def disconnect(self):
+        self._detener_supervisor.set()
+        self._cambio_conexion.set()
+        if self._supervisor and self._supervisor is not threading.current_thread():
+            self._supervisor.join(timeout=self.timeout_conexion + 1)
+        self._supervisor = None
         try:
             self.client.disconnect()
             self.client.loop_stop()
-            print("[MQTT] Desconectado del broker")
+            log.info("Desconectado del broker")
         except Exception as e:
-            print(f"[MQTT] Error al desconectar: {e}")
+            log.error("Error al desconectar: %s", e)
             self.error_flag = True
 
-    def publish(self, topic: str, message, qos: int = 0, retain: bool = False, timeout: float = 5.0):
+    def publicar_async(self, topic: str, message, qos: int = 0, retain: bool = False, timeout: float = 5.0):
+        """
+        Publica sin esperar confirmación y retorna un Future que se resuelve con True
+        desde on_publish, o con False si falla, se desconecta o pasa 'timeout' sin confirmar.
+        Si ya hay 'ventana_vuelo' mensajes sin confirmar retorna None.
+        """
+        with self._lock_vuelo:
+            vencidos = self._vencidos(timeout)
+            reservado = len(self._en_vuelo) + self._reservados < self.ventana_vuelo
+            if reservado:
+                self._reservados += 1
+        self._fallar_en_vuelo(vencidos)
+        if not reservado:
+            return None
+
+        futuro = Future()
+        futuro.set_running_or_notify_cancel()
+        info = None
         try:
-            with self.lock:
-                start_time = time.time()
-                while not self.is_connected:
-                    if time.time() - start_time > timeout:
-                        print("[MQTT] Tiempo de espera agotado para conectar.")
-                        self.error_flag = True
-                        return
-                    time.sleep(0.1)
-
-                payload = json.dumps(message)
-                result = self.client.publish(topic, payload, qos=qos, retain=retain)
-                start_time = time.time()
-                while not result.is_published():
-                    if time.time() - start_time > timeout:
-                        print(f"[MQTT] Timeout esperando confirmacion de publicacion en {topic}")
-                        self.error_flag = True
-                        return
-                    time.sleep(0.1)
+            payload = message if isinstance(message, (str, bytes)) else json.dumps(message)
+            info = self.client.publish(topic, payload, qos=qos, retain=retain)
         except Exception as e:
-            print(f"[MQTT] Error publicando en {topic}: {e}")
+            log.error("Error publicando en %s: %s", topic, e)
             self.error_flag = True
+        finally:
+            with self._lock_vuelo:
+                self._reservados -= 1
+                self.publicaciones_intentadas += 1
+                aceptado = info is not None and (
+                    info.rc == mqtt.MQTT_ERR_SUCCESS or (qos > 0 and info.rc == mqtt.MQTT_ERR_NO_CONN))
+                if aceptado:
+                    self._fallidos.discard(info.mid)
+                if aceptado and info.mid in self._publicados_tempranos:
+                    self._publicados_tempranos.discard(info.mid)
+                    self.publicaciones_confirmadas += 1
+                    confirmado = True
+                elif aceptado:
+                    self._en_vuelo[info.mid] = (futuro, time.monotonic())
+                    confirmado = None
+                else:
+                    confirmado = False
+                if not self._reservados:
+                    # Sin publicaciones en curso ningún mid temprano puede ser propio
+                    self._publicados_tempranos.clear()
 
-    def subscribe(self, topic: str, qos: int = 0, timeout: float = 5.0):
-        try:
-            with self.lock:
-                start_time = time.time()
-                while not self.is_connected:
-                    if time.time() - start_time > timeout:
-                        print("[MQTT] Tiempo de espera agotado para conectar.")
-                        self.error_flag = True
-                        return
-                    time.sleep(0.1)
-
-                self.client.subscribe(topic, qos)
-                print(f"[MQTT] Suscrito a {topic}")
+        if confirmado is not None:
+            futuro.set_result(confirmado)
+        return futuro
 
-        except Exception as e:
-            print(f"[MQTT] Error al suscribirse a {topic}: {e}")
+    def en_vuelo(self) -> int:
+        return len(self._en_vuelo)
+
+    def verificar_vencidos(self, timeout=None):
+        """
+        Falla las publicaciones sin confirmar tras 'timeout' s (timeout_publicacion por
+        defecto) y activa error_flag. Sin publicaciones nuevas publicar_async() no las
+        revisa, por eso el supervisor la llama cada segundo.
+        """
+        with self._lock_vuelo:
+            vencidos = self._vencidos(self.timeout_publicacion if timeout is None else timeout)
+        self._fallar_en_vuelo(vencidos)
+
+    def _vencidos(self, timeout):
+        # Se llama con _lock_vuelo tomado; el dict mantiene orden de envío
+        limite = time.monotonic() - timeout
+        vencidos = []
+        for mid, (_, instante) in self._en_vuelo.items():
+            if instante >= limite:
+                break
+            vencidos.append(mid)
+        if vencidos:
+            self.publicaciones_vencidas += len(vencidos)
+            log.warning("%d publicaciones sin confirmar tras %s s", len(vencidos), timeout)
             self.error_flag = True
+        return vencidos
+
+    def _fallar_en_vuelo(self, mids=None):
+        # Los Future se resuelven fuera del lock porque sus callbacks pueden publicar de nuevo
+        futuros = []
+        with self._lock_vuelo:
+            for mid in (list(self._en_vuelo) if mids is None else mids):
+                entrada = self._en_vuelo.pop(mid, None)
+                if entrada:
+                    futuros.append(entrada[0])
+                    self._fallidos.add(mid)
+        for futuro in futuros:
+            futuro.set_result(False)
+
+    def subscribe(self, topic: str, qos: int = 0):
+        """
+        Registra la suscripción y la envía si hay conexión; si no, se envía al conectar.
+        """
+        with self.lock:
+            self.suscripciones[topic] = qos
+        if self.is_connected:
+            self._enviar_suscripcion(topic, qos)
 
     def unsubscribe(self, topic: str):
+        with self.lock:
+            self.suscripciones.pop(topic, None)
+        if not self.is_connected:
+            return
+        try:
+            self.client.unsubscribe(topic)
+        except Exception as e:
+            log.error("Error al desuscribirse de %s: %s", topic, e)
+            self.error_flag = True
+
+    def _resuscribir(self):
+        # Con clean_session=True el broker olvida las suscripciones en cada conexión
+        with self.lock:
+            suscripciones = list(self.suscripciones.items())
+        for topic, qos in suscripciones:
+            self._enviar_suscripcion(topic, qos)
+
+    def _enviar_suscripcion(self, topic, qos):
+        # Se llama sin self.lock: paho puede invocar callbacks mientras suscribe
         try:
-            with self.lock:
-                self.client.unsubscribe(topic)
+            self.client.subscribe(topic, qos)
+            log.info("Suscrito a %s", topic)
         except Exception as e:
-            print(f"[MQTT] Error al desuscribirse de {topic}: {e}")
+            log.error("Error al suscribirse a %s: %s", topic, e)
             self.error_flag = True
@@ -0,0 +1,115 @@
+import time
+import socket
+import threading
+from logs_LIB import obtener_logger
+
+log = obtener_logger("red")
+
+
+class MonitorConectividad:
+    """
+    Verifica el acceso a internet en un hilo propio y deja el resultado en caché.
+    El lazo principal solo lee 'internet_ok', sin lanzar procesos ni bloquearse.
+    """
+    def __init__(
+        self,
+        host: str = "8.8.8.8",
+        puerto: int = 53,
+        timeout: float = 2.0,
+        intervalo: float = 30.0,
+        intervalo_min: float = 1.0,
+        intervalo_max: float = 60.0,
+        verificador=None
+    ):
+        self.host = host
+        self.puerto = puerto
+        self.timeout = timeout
+        self.verificador = verificador  # función opcional que reemplaza la prueba TCP (retorna bool)
+
+        # Con internet se verifica cada 'intervalo'; sin internet se reintenta
+        # desde 'intervalo_min' duplicando la espera hasta 'intervalo_max'
+        self.intervalo = intervalo
+        self.intervalo_min = intervalo_min
+        self.intervalo_max = intervalo_max
+
+        # Estado en caché
+        self.internet_ok = False
+        self.ultima_verificacion = None   # time.time() de la última verificación o señal
+        self.fallos_consecutivos = 0
+
+        self._evento_verificar = threading.Event()
+        self._evento_detener = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._evento_detener.clear()
+        self._hilo = threading.Thread(target=self._ejecutar, name="monitor_conectividad", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._evento_detener.set()
+        self._evento_verificar.set()
+        if self._hilo:
+            self._hilo.join(timeout=self.timeout + 1)
+            self._hilo = None
+
+    def forzar_verificacion(self):
+        """
+        Despierta al hilo para verificar de inmediato.
+        """
+        self._evento_verificar.set()
+
+    def notificar_mqtt(self, conectado: bool):
+        """
+        Señal desde los eventos de conexión MQTT: una conexión exitosa confirma
+        que hay internet; una desconexión obliga a verificar de inmediato.
+        """
+        if conectado:
+            self._actualizar_estado(True)
+        else:
+            self.forzar_verificacion()
+
+    def verificar(self) -> bool:
+        if self.verificador:
+            ok = bool(self.verificador())
+        else:
+            try:
+                with socket.create_connection((self.host, self.puerto), timeout=self.timeout):
+                    pass
+                ok = True
+            except OSError:
+                ok = False
+        self._actualizar_estado(ok)
+        return ok
+
+    def _actualizar_estado(self, ok: bool):
+        if ok != self.internet_ok:
+            if ok:
+                log.info("Acceso a internet restablecido")
+            else:
+                log.warning("Sin acceso a internet")
+        self.internet_ok = ok
+        self.ultima_verificacion = time.time()
+        if ok:
+            self.fallos_consecutivos = 0
+        else:
+            self.fallos_consecutivos += 1
+
+    def _proxima_espera(self) -> float:
+        if self.internet_ok:
+            return self.intervalo
+        espera = self.intervalo_min * (2 ** min(max(self.fallos_consecutivos - 1, 0), 16))
+        return min(espera, self.intervalo_max)
+
+    def _ejecutar(self):
+        while not self._evento_detener.is_set():
+            self._evento_verificar.clear()
+            try:
+                self.verificar()
+            except Exception as e:
+                log.error("Error al verificar conectividad: %s - %s", type(e).__name__, e)
+                self._actualizar_estado(False)
+
+            self._evento_verificar.wait(self._proxima_espera())
@@ -0,0 +1,229 @@
+import time
+import queue
+import random
+import threading
+from collections import deque
+from types import SimpleNamespace
+from tramas_LIB import cifrar
+
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+
+
+class RadioSimulada:
+    """
+    Backend de radio que reemplaza a lora_LIB.RadioRFM9x sin hardware.
+    Genera tramas codificadas como las de los botones a 'tasa' tramas/s, con la
+    distribución de códigos 'pesos_codigos', y llama al callback igual que DIO0.
+    Las tramas enviadas (ACKs) se cuentan y se guardan las últimas en 'enviados'.
+    """
+    def __init__(
+        self,
+        mac_destino: str,
+        id_red: str = "0x12",
+        tasa: float = 100.0,
+        dispositivos: int = 200,
+        pesos_codigos=None,
+        prob_sincro: float = 0.05,
+        prob_corrupta: float = 0.0,
+        total: int = None,
+        semilla=None
+    ):
+        self.mac_destino = mac_destino
+        self.id_red = id_red
+        self.tasa = tasa
+        self.pesos_codigos = pesos_codigos or {
+            'AA': 5, 'BB': 10, 'BA': 10, 'CC': 20, 'DD': 20, 'EE': 5,
+            'NN': 5, 'RI': 1, 'SI': 1, 'SS': 15, 'SV': 8
+        }
+        self.prob_sincro = prob_sincro
+        self.prob_corrupta = prob_corrupta
+        self.total = total
+
+        # Modulación informada al planificador de transmisión (igual que RadioRFM9x)
+        self.spreading_factor = 7
+        self.ancho_banda = 125E3
+        self.tasa_codificacion = 5
+        self.preambulo = 8
+
+        self._rnd = random.Random(semilla)
+        self.macs = [
+            ":".join(f"{self._rnd.randint(0, 255):02X}" for _ in range(6)) for _ in range(dispositivos)
+        ]
+        self._codigos = list(self.pesos_codigos)
+        self._pesos = list(self.pesos_codigos.values())
+
+        # Tramas generadas a la espera de recibir() y registro de envíos
+        self._pendientes = deque()
+        self.enviados = deque(maxlen=1000)
+        self.total_generadas = 0
+        self.total_enviados = 0
+
+        self._callback = None
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def generar_trama(self) -> bytes:
+        rnd = self._rnd
+        mac = rnd.choice(self.macs)
+        if rnd.random() < self.prob_sincro:
+            texto = f"FF,{mac}"
+        else:
+            codigo = rnd.choices(self._codigos, self._pesos)[0]
+            texto = f"{codigo},{self.mac_destino},{mac},0,{rnd.randint(5, 100)}.0"
+
+        direccion = rnd.randint(0, 1)
+        clave = rnd.randint(1, 10)
+        # cifrar() con la misma dirección es la operación inversa de decode()
+        trama = f"{direccion},{clave},{cifrar(direccion, clave, texto)}"
+
+        if rnd.random() < self.prob_corrupta:
+            posicion = rnd.randrange(len(trama))
+            trama = trama[:posicion] + chr(rnd.randint(33, 126)) + trama[posicion + 1:]
+        return f"{self.id_red}:{trama}".encode("ascii")
+
+    def iniciar(self, callback):
+        self._callback = callback
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._generar, name="radio_simulada", daemon=True)
+        self._hilo.start()
+
+    def recibir(self):
+        try:
+            return self._pendientes.popleft(), -40 - self._rnd.random() * 80
+        except IndexError:
+            return None
+
+    def enviar(self, datos: bytes):
+        self.enviados.append(datos)
+        self.total_enviados += 1
+
+    def cerrar(self):
+        self._detener.set()
+        if self._hilo and self._hilo is not threading.current_thread():
+            self._hilo.join(timeout=1)
+        self._hilo = None
+
+    def _generar(self):
+        # Se generan lotes cada 10 ms para sostener miles de tramas/s sin depender de sleep() por trama
+        periodo = 0.01
+        inicio = time.monotonic()
+        while not self._detener.is_set():
+            if self.total is not None and self.total_generadas >= self.total:
+                break
+            objetivo = int((time.monotonic() - inicio) * self.tasa)
+            if self.total is not None:
+                objetivo = min(objetivo, self.total)
+            while self.total_generadas < objetivo:
+                self._pendientes.append(self.generar_trama())
+                self.total_generadas += 1
+                self._callback()
+            self._detener.wait(periodo)
+
+
+class ClienteMQTTSimulado:
+    """
+    Reemplazo en proceso de paho.mqtt.client.Client para MQTTClientHandler.
+    Acepta conexiones al instante, confirma cada publicación desde un hilo propio
+    después de 'latencia' segundos (como el hilo de red de paho) y guarda las
+    últimas publicaciones en 'publicados'.
+    """
+    def __init__(self, latencia: float = 0.0, conectar_ok: bool = True):
+        self.latencia = latencia
+        self.conectar_ok = conectar_ok
+
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_publish = None
+        self.on_subscribe = None
+
+        self.conectado = False
+        self.suscripciones = set()
+        self.publicados = deque(maxlen=1000)
+        self.total_publicados = 0
+
+        self._mid = 0
+        self._lock = threading.Lock()
+        self._confirmaciones = queue.Queue()
+        self._hilo = None
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def connect(self, host, port=1883, keepalive=60):
+        self.conectado = self.conectar_ok
+        if self.on_connect:
+            self.on_connect(self, None, None, 0 if self.conectar_ok else 5, None)
+        return MQTT_ERR_SUCCESS if self.conectar_ok else MQTT_ERR_NO_CONN
+
+    def reconnect(self):
+        return self.connect(None)
+
+    def disconnect(self):
+        self.conectado = False
+        if self.on_disconnect:
+            self.on_disconnect(self, None, None, 0, None)
+        return MQTT_ERR_SUCCESS
+
+    def loop_start(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._confirmar, name="broker_simulado", daemon=True)
+            self._hilo.start()
+
+    def loop_stop(self):
+        if self._hilo:
+            self._confirmaciones.put(None)
+            self._hilo.join(timeout=1)
+            self._hilo = None
+
+    def is_connected(self):
+        return self.conectado
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        with self._lock:
+            self._mid += 1
+            mid = self._mid
+        if not self.conectado:
+            return SimpleNamespace(mid=mid, rc=MQTT_ERR_NO_CONN)
+        self.publicados.append((topic, payload))
+        self.total_publicados += 1
+        self._confirmaciones.put((time.monotonic() + self.latencia, mid))
+        return SimpleNamespace(mid=mid, rc=MQTT_ERR_SUCCESS)
+
+    def subscribe(self, topic, qos=0):
+        self.suscripciones.add(topic)
+        with self._lock:
+            self._mid += 1
+            return MQTT_ERR_SUCCESS, self._mid
+
+    def unsubscribe(self, topic):
+        self.suscripciones.discard(topic)
+        return MQTT_ERR_SUCCESS, 0
+
+    def cortar_conexion(self):
+        """
+        Simula una caída del broker o de la WAN (desconexión inesperada).
+        """
+        self.conectado = False
+        if self.on_disconnect:
+            self.on_disconnect(self, None, None, 7, None)
+
+    def inyectar_mensaje(self, topic: str, payload: bytes):
+        """
+        Simula un mensaje de bajada del broker (llama a on_message).
+        """
+        if self.on_message:
+            self.on_message(self, None, SimpleNamespace(topic=topic, payload=payload))
+
+    def _confirmar(self):
+        while True:
+            elemento = self._confirmaciones.get()
+            if elemento is None:
+                return
+            instante, mid = elemento
+            espera = instante - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            if self.on_publish:
+                self.on_publish(self, None, mid, None, None)
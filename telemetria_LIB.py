@@ -0,0 +1,144 @@
+import time
+import json
+from collections import OrderedDict
+
+CODIGOS_TELEMETRIA = ('SS', 'SV')
+
+
+class VentanaSensor:
+    """
+    Acumulado de lecturas de un dispositivo durante una ventana de agregación.
+    """
+    __slots__ = ("inicio", "ultimo_payload", "muestras", "estadisticas")
+
+    def __init__(self, inicio):
+        self.inicio = inicio
+        self.ultimo_payload = None
+        self.muestras = 0
+        # (nombre sensor, número, tipo de valor) -> [min, max, suma, cantidad, último]
+        self.estadisticas = {}
+
+
+class AgregadorTelemetria:
+    """
+    Agrupa las lecturas de sensores ('SS', 'SV') por dispositivo y sensor en ventanas
+    de 'ventana' segundos, y publica por ventana un único payload con min/max/mean/last.
+    Una lectura fuera de [Lmin, Lmax] se publica de inmediato, sin esperar la ventana.
+    La cantidad de ventanas abiertas se limita a 'max_dispositivos'; al superarla se
+    cierra la más antigua.
+    """
+    def __init__(self, ventana=60.0, codigos=CODIGOS_TELEMETRIA, max_dispositivos=5000):
+        self.ventana = ventana
+        self.codigos = set(codigos)
+        self.max_dispositivos = max_dispositivos
+        self._ventanas = OrderedDict()   # mac -> VentanaSensor, en orden de apertura
+        self._forzadas = []              # ventanas cerradas por límite de memoria
+
+        # Estadísticas
+        self.lecturas = 0
+        self.inmediatas = 0
+        self.ventanas_publicadas = 0
+
+    def agregar(self, codigo, mac, payload, lecturas=(), instante=None):
+        """
+        'payload' es el evento ya serializado y 'lecturas' sus valores como
+        ((name, number, type), valor, Lmin, Lmax) (ver tramas_LIB.lecturas_sensor):
+        el JSON solo se parsea una vez por ventana, al publicarla.
+        Retorna el payload si debe publicarse ya (no es telemetría o cruza un umbral),
+        o None si quedó acumulado en la ventana del dispositivo.
+        """
+        if codigo not in self.codigos:
+            return payload
+
+        instante = time.monotonic() if instante is None else instante
+        self.lecturas += 1
+
+        ventana = self._ventanas.get(mac)
+        if ventana is None:
+            ventana = self._ventanas[mac] = VentanaSensor(instante)
+            if len(self._ventanas) > self.max_dispositivos:
+                self._forzadas.append(self._ventanas.popitem(last=False))
+
+        fuera_de_rango = False
+        for clave, lectura, minimo, maximo in lecturas:
+            if not isinstance(lectura, (int, float)):
+                continue
+            acumulado = ventana.estadisticas.get(clave)
+            if acumulado is None:
+                ventana.estadisticas[clave] = [lectura, lectura, lectura, 1, lectura]
+            else:
+                if lectura < acumulado[0]:
+                    acumulado[0] = lectura
+                if lectura > acumulado[1]:
+                    acumulado[1] = lectura
+                acumulado[2] += lectura
+                acumulado[3] += 1
+                acumulado[4] = lectura
+
+            if (minimo is not None and lectura < minimo) or (maximo is not None and lectura > maximo):
+                fuera_de_rango = True
+
+        ventana.ultimo_payload = payload
+        ventana.muestras += 1
+
+        if fuera_de_rango:
+            self.inmediatas += 1
+            return payload
+        return None
+
+    def proximo_vencimiento(self):
+        """
+        Instante (time.monotonic) en que vence la ventana más antigua, o None si no hay.
+        """
+        if self._forzadas:
+            return 0.0
+        for ventana in self._ventanas.values():
+            return ventana.inicio + self.ventana
+        return None
+
+    def vencidos(self, instante=None, forzar=False):
+        """
+        Cierra las ventanas vencidas (todas si forzar=True) y retorna [(mac, payload agregado)].
+        """
+        instante = time.monotonic() if instante is None else instante
+        cerradas, self._forzadas = self._forzadas, []
+        while self._ventanas:
+            mac, ventana = next(iter(self._ventanas.items()))
+            if not forzar and instante - ventana.inicio < self.ventana:
+                break
+            del self._ventanas[mac]
+            cerradas.append((mac, ventana))
+
+        resultado = []
+        for mac, ventana in cerradas:
+            if ventana.muestras:
+                resultado.append((mac, self._payload_agregado(ventana, instante)))
+        self.ventanas_publicadas += len(resultado)
+        return resultado
+
+    def _payload_agregado(self, ventana, instante):
+        payload = json.loads(ventana.ultimo_payload)
+        for sensor in payload.get("sensor", []):
+            for valor in sensor.get("values", []):
+                acumulado = ventana.estadisticas.get((sensor.get("name"), sensor.get("number"), valor.get("type")))
+                if acumulado is None:
+                    continue
+                minimo, maximo, suma, cantidad, ultimo = acumulado
+                valor["value"] = ultimo
+                valor["min"] = minimo
+                valor["max"] = maximo
+                valor["mean"] = round(suma / cantidad, 3)
+                valor["count"] = cantidad
+        payload["ventana"] = {
+            "segundos": round(instante - ventana.inicio, 3),
+            "muestras": ventana.muestras
+        }
+        return payload
+
+    def estadisticas(self):
+        return {
+            "lecturas": self.lecturas,
+            "inmediatas": self.inmediatas,
+            "ventanas_abiertas": len(self._ventanas),
+            "ventanas_publicadas": self.ventanas_publicadas
+        }
@@ -1,8 +1,14 @@
 import json
+import time
 import random
 import subprocess
+from collections import OrderedDict
 from datetime import datetime
+from json.encoder import encode_basestring_ascii
 from archivos_LIB import FileHandler
+from logs_LIB import obtener_logger
+
+log = obtener_logger("tramas")
 
 
 CANTIDAD_CARACTERES = 72
@@ -12,12 +18,195 @@ alfa = ['<', ':', '-', 'R', ' ', '%', 'Z', '^', 'h', 'A', '7', 'K', 'j', 'z', 'J
         '1', 'U', ',', 'G', '+', '0', 'X', 'a', 'H', 'P', 'w', 'e', 'x', 'T', 'p', 't',
         'q', 'v', 'o', 'O', '*', 'Y', '.', 'S']
 
+# Tablas de sustitución precalculadas para str.translate: TABLAS_DESPLAZAMIENTO[d]
+# reemplaza cada símbolo de 'alfa' por el que está 'd' posiciones adelante.
+# Los caracteres fuera de 'alfa' no aparecen en la tabla y quedan igual.
+TABLAS_DESPLAZAMIENTO = [
+    str.maketrans({char: alfa[(pos + desplazamiento) % CANTIDAD_CARACTERES] for pos, char in enumerate(alfa)})
+    for desplazamiento in range(CANTIDAD_CARACTERES)
+]
+
+
+def decodificar(decodifier, key, msg):
+    """
+    Decodifica 'msg' desplazando key posiciones hacia adelante (decodifier == 1) o hacia atrás.
+    """
+    desplazamiento = key if decodifier == 1 else -key
+    return msg.translate(TABLAS_DESPLAZAMIENTO[desplazamiento % CANTIDAD_CARACTERES])
+
+
+def cifrar(direccion, clave, mensaje):
+    """
+    Operación inversa a decodificar: con direccion == 1 desplaza hacia atrás.
+    """
+    desplazamiento = -clave if direccion == 1 else clave
+    return mensaje.translate(TABLAS_DESPLAZAMIENTO[desplazamiento % CANTIDAD_CARACTERES])
+
+
+# Sensor de batería del payload; sus límites son también los umbrales del agregador de telemetría
+SENSOR_BATERIA = ("BAT", 1, "BATERIA")
+BATERIA_LMIN = 10
+BATERIA_LMAX = 100
+
+
+def estructura_payload(llamado, empresa, sede, area, mac, timestamp, bateria):
+    """
+    Payload de un evento tal como se publica en MQTT.
+    """
+    return {
+        "llamado": llamado,
+        "empresa": empresa,
+        "sede": sede,
+        "area": area,
+        "mac": mac,
+        "timestamp": timestamp,
+        "sensor": [
+            {
+                "type": 100,
+                "name": SENSOR_BATERIA[0],
+                "number": SENSOR_BATERIA[1],
+                "values": [
+                    {
+                        "type": SENSOR_BATERIA[2],
+                        "value": bateria,
+                        "unit": "%",
+                        "Lmin": BATERIA_LMIN,
+                        "Lmax": BATERIA_LMAX
+                    }
+                ]
+            }
+        ]
+    }
+
+
+def lecturas_sensor(bateria):
+    """
+    Lecturas del bloque 'sensor' de estructura_payload() como ((name, number, type), valor, Lmin, Lmax),
+    para agregar telemetría sin volver a parsear el payload serializado.
+    """
+    return [(SENSOR_BATERIA, bateria, BATERIA_LMIN, BATERIA_LMAX)]
+
+
+class CodificadorPayload:
+    """
+    Serializa el payload de un evento directo a bytes JSON. Las partes fijas (empresa,
+    sede, área y el bloque del sensor) se pre-renderizan en actualizar() al cambiar la
+    configuración; por evento solo se escapan llamado, mac, batería y la marca de
+    tiempo (que se reutiliza dentro del mismo segundo). El resultado es idéntico a
+    json.dumps(estructura_payload(...)).encode().
+    """
+    CAMPOS_VARIABLES = ("llamado", "mac", "timestamp")  # la batería va dentro del bloque del sensor
+    CAMPOS_CONFIGURACION = ("empresa", "sede", "area")
+    MARCADOR_BATERIA = "@@bateria@@"
+
+    def __init__(self, empresa=None, sede=None, area=None):
+        self._segmentos = ()
+        self._segundo = None
+        self._marca_tiempo = b""
+        self.actualizar(empresa, sede, area)
+
+    def actualizar(self, empresa, sede, area):
+        # La plantilla se arma clave por clave en el orden de estructura_payload(). No se
+        # busca un marcador en el JSON completo: la configuración llega por MQTT y un valor
+        # igual al marcador movería los campos de lugar
+        estructura = estructura_payload(None, empresa, sede, area, None, None, self.MARCADOR_BATERIA)
+        segmentos = []
+        actual = "{"
+        for indice, (clave, valor) in enumerate(estructura.items()):
+            actual += (", " if indice else "") + json.dumps(clave) + ": "
+            if clave in self.CAMPOS_VARIABLES:
+                segmentos.append(actual)
+                actual = ""
+            elif clave in self.CAMPOS_CONFIGURACION:
+                actual += json.dumps(valor)
+            else:
+                # Partes fijas (bloque del sensor): sin datos de configuración, así que la
+                # batería se puede ubicar por su marcador
+                texto = json.dumps(valor)
+                marcador = json.dumps(self.MARCADOR_BATERIA)
+                if marcador in texto:
+                    anterior, texto = texto.split(marcador, 1)
+                    segmentos.append(actual + anterior)
+                    actual = ""
+                actual += texto
+        segmentos.append(actual + "}")
+        self._segmentos = tuple(texto.encode("ascii") for texto in segmentos)
+
+    def _timestamp(self):
+        segundo = int(time.time())
+        if segundo != self._segundo:
+            self._segundo = segundo
+            self._marca_tiempo = encode_basestring_ascii(
+                time.strftime("%Y:%m:%d %H:%M:%S", time.localtime(segundo))).encode("ascii")
+        return self._marca_tiempo
+
+    def codificar(self, llamado, mac, bateria) -> bytes:
+        s0, s1, s2, s3, s4 = self._segmentos
+        valor = repr(bateria) if type(bateria) is float and bateria - bateria == 0 else json.dumps(bateria)
+        return b"".join((
+            s0, encode_basestring_ascii(llamado).encode("ascii"),
+            s1, encode_basestring_ascii(mac).encode("ascii"),
+            s2, self._timestamp(),
+            s3, valor.encode("ascii"),
+            s4
+        ))
+
+
+class CacheDuplicados:
+    """
+    Detecta retransmisiones: guarda por MAC remitente la última (código, contenido)
+    recibida y considera duplicada una trama idéntica dentro de 'ventana' segundos.
+    Un llamado distinto del mismo dispositivo reemplaza la entrada, así un segundo
+    llamado real después de un cambio de estado no se suprime.
+    La memoria queda acotada a 'max_entradas' MACs (se expulsa la menos reciente).
+    """
+    def __init__(self, ventana=15.0, max_entradas=2048):
+        self.ventana = ventana
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()   # mac -> (codigo, contenido, instante)
+
+        # Estadísticas
+        self.aciertos = 0
+        self.fallos = 0
+
+    def es_duplicado(self, mac, codigo, contenido, instante=None) -> bool:
+        instante = time.monotonic() if instante is None else instante
+        previa = self._entradas.get(mac)
+
+        if previa is not None and previa[0] == codigo and previa[1] == contenido and instante - previa[2] <= self.ventana:
+            self.aciertos += 1
+            self._entradas.move_to_end(mac)
+            return True
+
+        self.fallos += 1
+        self._entradas[mac] = (codigo, contenido, instante)
+        self._entradas.move_to_end(mac)
+        if len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+        return False
+
+    def estadisticas(self):
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "entradas": len(self._entradas)
+        }
+
+
 class TramaHandler:
-    def __init__(self):
+    def __init__(self, archivo=None, metricas=None):
         self.direccion = 1
+        self.metricas = metricas  # MetricasLatencia opcional para medir decodificación y JSON
         self.mac_remitente = ""
         self.mac_local = self.obtener_mac()
         self.llamado_text = ""
+        self.codigo = None
+        self.bateria = None  # batería informada en la última trama (None en sincronización)
+        self.duplicado = False
+        self.cache_duplicados = CacheDuplicados()
+        self.codificador = CodificadorPayload()
+        self.invalidas = 0  # tramas corruptas o con formato inválido
+        self.ajenas = 0     # tramas dirigidas a otro gateway
         self.acciones = {
             'FF': "sincro",
             'NN': "notificación",
@@ -32,6 +221,14 @@ class TramaHandler:
             'SI': "sensor incendio",
             'SV': "sensor vibración"
         }
+
+        # Parámetros de configuración en memoria, actualizados por FileHandler al cambiar
+        self.empresa = None
+        self.sede = None
+        self.area = None
+        self.archivo = archivo if archivo else FileHandler()
+        self.archivo.suscribir(self.actualizar_parametros)
+        self.archivo.obtener_configuracion()
     
     def obtener_mac(self):
         try:
@@ -43,17 +240,12 @@ class TramaHandler:
         except subprocess.CalledProcessError:
             return None
         
-    def leer_parametros(self):
-        archivo = FileHandler()
-        df = archivo.leer_archivo()
-
-        # Obtenemos directamente los valores porque las claves siempre existen desde crear_archivo
-        empresa = df.loc[df["clave"] == "empresa", "valor"].values[0]
-        sede    = df.loc[df["clave"] == "sede", "valor"].values[0]
-        area    = df.loc[df["clave"] == "area", "valor"].values[0]
-
-        return empresa, sede, area
-
+    def actualizar_parametros(self, configuracion):
+        # Las claves siempre existen desde crear_archivo
+        self.empresa = configuracion.get("empresa")
+        self.sede    = configuracion.get("sede")
+        self.area    = configuracion.get("area")
+        self.codificador.actualizar(self.empresa, self.sede, self.area)
 
     def codificar(self, mensaje: str) -> str:
         """
@@ -68,50 +260,36 @@ class TramaHandler:
         # Clave aleatoria entre 1 y 10
         clave = random.randint(1, 10)
 
-        resultado = ""
-        for char in mensaje:
-            if char in alfa:
-                pos = alfa.index(char)
-                if self.direccion == 1:
-                    pos = (pos - clave) % CANTIDAD_CARACTERES  # inverso a decode
-                else:
-                    pos = (pos + clave) % CANTIDAD_CARACTERES
-                resultado += alfa[pos]
-            else:
-                resultado += char
+        resultado = cifrar(self.direccion, clave, mensaje)
 
         # Devuelve la trama completa lista
         return f"{self.direccion},{clave},{resultado}"
     
     def decode(self, decodifier, key, msg, debug=False):
-        msg_2 = ""
-
-        for char in msg:
-            if char in alfa:
-                position = alfa.index(char)
-                if decodifier == 1:
-                    position = (position + key) % CANTIDAD_CARACTERES
-                else:
-                    position = (position - key) % CANTIDAD_CARACTERES
-                msg_2 += alfa[position]
-            else:
-                msg_2 += char
+        msg_2 = decodificar(decodifier, key, msg)
 
         if debug:
-            print("Mensaje decodificado:", msg_2)
+            log.debug("Mensaje decodificado: %s", msg_2)
         return msg_2
 
 
     def procesar(self, trama):
+        inicio = time.monotonic()
         partes = trama.strip().split(",")
 
         if len(partes) < 3:
-            print("Trama inválida")
+            self.invalidas += 1
+            log.warning("Trama inválida: %s", trama)
             return None
 
-        # Extraigo los parámetros de cifrado
-        decodifier = int(partes[0])
-        key = int(partes[1])
+        # Extraigo los parámetros de cifrado (una trama corrupta puede traer basura)
+        try:
+            decodifier = int(partes[0])
+            key = int(partes[1])
+        except ValueError:
+            self.invalidas += 1
+            log.warning("Parámetros de cifrado inválidos: %s", trama)
+            return None
         msg = ",".join(partes[2:])
 
         decoded_msg = self.decode(decodifier, key, msg, debug=True)
@@ -130,12 +308,14 @@ class TramaHandler:
             try:
                 bateria_valor = float(bateria_str)
             except ValueError:
-                print("Valor de batería inválido.")
+                self.invalidas += 1
+                log.warning("Valor de batería inválido: %s", decoded_msg)
                 return None
 
             # FILTRADO POR MAC DESTINATARIO
             if mac_destinatario.upper() != self.mac_local.upper():
-                print(f"Ignorado: MAC destinatario {mac_destinatario} ≠ MAC local {self.mac_local}")
+                self.ajenas += 1
+                log.debug("Ignorado: MAC destinatario %s ≠ MAC local %s", mac_destinatario, self.mac_local)
                 return None
 
         elif len(decoded_parts) == 2:
@@ -143,56 +323,37 @@ class TramaHandler:
             bateria_valor = 100.0  # fijo al 100%
 
         else:
-            print("Formato de mensaje inválido.")
+            self.invalidas += 1
+            log.warning("Formato de mensaje inválido: %s", decoded_msg)
             return None
 
         self.mac_remitente = mac_remitente
+        self.codigo = code
+        self.bateria = bateria_valor if len(decoded_parts) == 5 else None
         llamado_text = self.acciones.get(code, code)
         self.llamado_text = llamado_text
 
-        print(f"Acción: {llamado_text}")
-        print(f"Mac remitente: {mac_remitente}")
-        print(f"Código: {code}")
-        print(f"Batería: {bateria_valor}%")
+        # Retransmisión de una trama ya atendida: se vuelve a confirmar pero no se publica
+        self.duplicado = self.cache_duplicados.es_duplicado(mac_remitente, code, decoded_msg)
+        if self.duplicado:
+            log.debug("Trama duplicada de %s, solo se reenvía ACK", mac_remitente)
+
+        log.debug("Acción: %s, MAC remitente: %s, código: %s, batería: %s%%",
+                  llamado_text, mac_remitente, code, bateria_valor)
 
-        # Construyo el JSON con batería fija o leída
-        json_payload = self.build_json(llamado_text, mac_remitente, bateria_valor)
-        print("JSON payload:", json.dumps(json_payload, indent=2))
+        if self.metricas:
+            inicio = self.metricas.registrar_desde("decodificacion", inicio)
+
+        # Serializo el JSON (una sola vez) con batería fija o leída
+        json_payload = self.codificador.codificar(llamado_text, mac_remitente, bateria_valor)
+        if self.metricas:
+            self.metricas.registrar_desde("json", inicio)
+        log.debug("JSON payload: %s", json_payload)
 
         return json_payload
 
 
     def build_json(self, llamado, mac, bateria):
-        empresa, sede, area = self.leer_parametros()
-
         now = datetime.now()
         timestamp = now.strftime("%Y:%m:%d %H:%M:%S")
-
-        payload = {
-            "llamado": llamado,
-            "empresa": empresa,
-            "sede": sede,
-            "area": area,
-            "mac": mac,
-            "timestamp": timestamp,
-            "sensor": [
-                {
-                    "type": 100,
-                    "name": "BAT",
-                    "number": 1,
-                    "values": [
-                        {
-                            "type": "BATERIA",
-                            "value": bateria,
-                            "unit": "%",
-                            "Lmin": 10,
-                            "Lmax": 100
-                        }
-                    ]
-                }
-            ]
-        }
-        
-        return payload
-
-
+        return estructura_payload(llamado, self.empresa, self.sede, self.area, mac, timestamp, bateria)